@@ -0,0 +1,99 @@
+"""
+Per-message routing cost: keyword detection plus owner command dispatch.
+
+    python bench/bench_dispatch.py --messages 200000
+
+Compares the previous substring scan and startswith chain against KEYWORD_RE and
+parse_command/OWNER_COMMANDS on a synthetic mix of chatter, keyword hits and commands.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import jarvis  # noqa: E402
+
+CHATTER = [
+    "anyone up for a game tonight",
+    "lol that was great",
+    "what time is the event on saturday?",
+    "brb grabbing food",
+    "can someone check the new map rotation, the spawn points feel off compared to last week",
+    "good morning everyone",
+    "i think the server is lagging a bit",
+]
+KEYWORD = [
+    "getting an error when I join",
+    "the bot crashed again",
+    "need help with setup",
+    "found a bug in the ticket system",
+]
+COMMANDS = [
+    "jarvis ban <@123> for spamming",
+    "jarvis warn <@123> for language",
+    "jarvis purge 20",
+    "jarvis unban 123456789",
+    "jarvis what do you think?",
+]
+OLD_VERBS = [
+    "jarvis ban", "jarvis unban", "jarvis warn", "jarvis unban", "jarvis warn",
+    "jarvis mute", "jarvis kick", "jarvis purge", "jarvis lockdown", "jarvis move",
+]
+
+
+def old_route(content, owner):
+    content_lower = content.lower()
+    keyword = any(word in content_lower for word in jarvis.IMPORTANT_KEYWORDS)
+    verb = None
+    if owner:
+        for candidate in OLD_VERBS:
+            if content_lower.startswith(candidate):
+                verb = candidate
+                break
+    return keyword, verb
+
+
+def new_route(content, owner):
+    content_lower = content.lower()
+    keyword = jarvis.KEYWORD_RE.search(content_lower) is not None
+    handler = None
+    if owner:
+        command = jarvis.parse_command(content)
+        if command:
+            handler = jarvis.OWNER_COMMANDS.get(command[0])
+    return keyword, handler
+
+
+def run(route, messages):
+    started = time.perf_counter()
+    for content, owner in messages:
+        route(content, owner)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200_000)
+    parser.add_argument("--owner-share", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    messages = []
+    for _ in range(args.messages):
+        owner = rng.random() < args.owner_share
+        pool = rng.choices([CHATTER, KEYWORD, COMMANDS], weights=[85, 10, 5 if owner else 0])[0]
+        messages.append((rng.choice(pool), owner))
+
+    for name, route in (("old", old_route), ("new", new_route)):
+        elapsed = min(run(route, messages) for _ in range(3))
+        print(
+            f"{name}: {elapsed / args.messages * 1e9:.0f} ns/message, "
+            f"{args.messages / elapsed:,.0f} messages/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Recall latency over a synthetic memory.db.
+
+    python bench/bench_memory_recall.py --rows 3000000
+
+Builds (or reuses) a database with the bot's schema, then times recall queries for
+random users/channels the same way recall_memory runs them.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import jarvis  # noqa: E402
+
+WORDS = [f"t{i:05d}" for i in range(20000)] + [
+    "server", "crash", "error", "setup", "role", "ticket", "ban", "voice", "music", "bot",
+    "login", "payment", "update", "restart", "lag", "map", "car", "job", "police", "discord",
+]
+
+
+def skewed(rng, n):
+    # Log-uniform: a few words, users and channels account for much of the traffic.
+    return int(n ** rng.random()) - 1
+
+
+def random_word(rng):
+    return WORDS[skewed(rng, len(WORDS))]
+
+
+def build(path, rows, users, channels, seed):
+    rng = random.Random(seed)
+    db = sqlite3.connect(path)
+    for pragma in jarvis.DB_PRAGMAS:
+        db.execute(pragma)
+    for statement in jarvis.SCHEMA:
+        db.execute(statement)
+    have = db.execute("SELECT count(*) FROM memory").fetchone()[0]
+    started = time.perf_counter()
+    batch = []
+    for _ in range(have, rows):
+        user = skewed(rng, users)
+        text = " ".join(random_word(rng) for _ in range(rng.randint(3, 20)))
+        batch.append((user, skewed(rng, channels), f"user{user}: {text}"))
+        if len(batch) == 10000:
+            db.executemany("INSERT INTO memory (user_id, channel_id, content) VALUES (?, ?, ?)", batch)
+            db.commit()
+            batch.clear()
+    if batch:
+        db.executemany("INSERT INTO memory (user_id, channel_id, content) VALUES (?, ?, ?)", batch)
+        db.commit()
+    if rows > have:
+        print(f"built {rows - have} rows in {time.perf_counter() - started:.1f}s")
+    return db, rng
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", default="bench_memory.db")
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--channels", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    db, rng = build(args.db, args.rows, args.users, args.channels, args.seed)
+    started = time.perf_counter()
+    jarvis.recall_common_terms = frozenset(
+        row[0] for row in db.execute(
+            jarvis.COMMON_TERMS_SQL, (jarvis.RECALL_COMMON_MIN_ROWS, jarvis.RECALL_COMMON_FRACTION)
+        )
+    )
+    print(f"{len(jarvis.recall_common_terms)} common terms loaded in {time.perf_counter() - started:.2f}s")
+
+    # Query as users who have history, the way recall runs for someone talking to the bot.
+    max_id = db.execute("SELECT max(id) FROM memory").fetchone()[0]
+    timings, hits = [], 0
+    for _ in range(args.queries):
+        user, channel = db.execute(
+            "SELECT user_id, channel_id FROM memory WHERE id >= ? LIMIT 1", (rng.randint(1, max_id),)
+        ).fetchone()
+        text = " ".join(random_word(rng) for _ in range(rng.randint(3, 15)))
+        terms = jarvis.recall_terms(text)
+        if not terms:
+            continue
+        started = time.perf_counter()
+        params = {
+            "query": jarvis.recall_query(user, channel, terms),
+            "user_id": user,
+            "channel_id": channel,
+            "limit": jarvis.RECALL_CANDIDATES,
+        }
+        candidates = [row[0] for row in db.execute(jarvis.RECALL_SQL, params)]
+        rows = jarvis.rank_recalled(terms, candidates, jarvis.RECALL_TOP_K)
+        timings.append((time.perf_counter() - started) * 1000)
+        hits += bool(rows)
+
+    timings.sort()
+    print(f"rows={args.rows} queries={len(timings)} with_results={hits}")
+    print(
+        f"p50={statistics.median(timings):.3f}ms "
+        f"p99={timings[int(len(timings) * 0.99) - 1]:.3f}ms "
+        f"max={timings[-1]:.3f}ms budget={jarvis.RECALL_BUDGET_MS}ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Replay a synthetic raid through RaidDetector.
+
+    python bench/bench_raid.py --raid-joins 10000
+
+Organic joins (aged accounts, many inviters, varied names) run for a while, then a raid of
+new accounts with similar names arrives through a few invites. Reports per-event cost,
+false alerts during the organic phase and how long after the raid started it was detected.
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import jarvis  # noqa: E402
+
+GUILD_ID = 1
+
+
+def organic_joins(rng, count, start, mean_gap):
+    t = start
+    for _ in range(count):
+        t += rng.expovariate(1 / mean_gap)
+        name = "".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 12)))
+        yield t, rng.choice([rng.randint(30, 3000), rng.randint(0, 6)]), rng.randrange(200), name
+
+
+def raid_joins(rng, count, start, rate):
+    t = start
+    bases = ["raider", "freenitro", "spammer"]
+    for i in range(count):
+        t += rng.expovariate(rate)
+        name = f"{rng.choice(bases)}{rng.randint(0, 9999)}"
+        yield t, rng.randint(0, 2), 10_000 + rng.randrange(3), name
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--organic-joins", type=int, default=2000)
+    parser.add_argument("--organic-gap", type=float, default=20.0, help="mean seconds between organic joins")
+    parser.add_argument("--raid-joins", type=int, default=10_000)
+    parser.add_argument("--raid-rate", type=float, default=25.0, help="raid joins per second")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    organic = list(organic_joins(rng, args.organic_joins, 0.0, args.organic_gap))
+    raid_start = organic[-1][0] + 1.0
+    raid = list(raid_joins(rng, args.raid_joins, raid_start, args.raid_rate))
+    # Organic traffic keeps arriving during the raid.
+    during = list(organic_joins(rng, int((raid[-1][0] - raid_start) / args.organic_gap), raid_start, args.organic_gap))
+    events = organic + sorted(raid + during)
+
+    detector = jarvis.RaidDetector()
+    false_alerts, detected_at, alerts = 0, None, 0
+    started = time.perf_counter()
+    for timestamp, age, inviter, name in events:
+        alert = detector.observe(GUILD_ID, timestamp, age, inviter, name)
+        if alert:
+            alerts += 1
+            if timestamp < raid_start:
+                false_alerts += 1
+            elif detected_at is None:
+                detected_at = timestamp
+    elapsed = time.perf_counter() - started
+
+    print(f"events={len(events)} ({args.raid_joins} raid) cost={elapsed / len(events) * 1e9:.0f} ns/event")
+    print(f"false alerts before raid: {false_alerts}, alerts total: {alerts}")
+    if detected_at is None:
+        print("raid not detected")
+    else:
+        raid_seen = sum(1 for t, *_ in raid if t <= detected_at)
+        print(f"detected {detected_at - raid_start:.2f}s after raid start, after {raid_seen} raid joins")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Throughput and accuracy of the auto-response relevance classifier.
+
+    python bench/bench_relevance.py --messages 200000 --batch 512
+
+Scores the eval fixtures (accuracy next to the old keyword trigger), then pushes --messages
+fixture texts through RelevanceModel.scores in batches of --batch on one core and reports
+messages/second against the 50k/s target, plus the cost of the same batches via RelevanceBatcher.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tools"))
+import jarvis  # noqa: E402
+from train_relevance import evaluate, load_fixtures  # noqa: E402
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+TARGET = 50_000  # messages/second
+
+
+def bench_scores(model, texts, batch):
+    started = time.perf_counter()
+    for i in range(0, len(texts), batch):
+        model.scores(texts[i:i + batch])
+    return time.perf_counter() - started
+
+
+async def bench_batcher(model, texts, batch):
+    batcher = jarvis.RelevanceBatcher(model, batch, 0.002)
+    started = time.perf_counter()
+    for i in range(0, len(texts), batch):
+        await asyncio.gather(*(batcher.score(text) for text in texts[i:i + batch]))
+    return time.perf_counter() - started, batcher.batches
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default=jarvis.RELEVANCE_MODEL)
+    parser.add_argument("--eval", default=os.path.join(ROOT, "fixtures", "relevance", "eval.jsonl"))
+    parser.add_argument("--messages", type=int, default=200_000)
+    parser.add_argument("--batch", type=int, default=jarvis.RELEVANCE_BATCH_SIZE)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    model = jarvis.RelevanceModel.load(args.model)
+    eval_texts, eval_labels = load_fixtures(args.eval)
+    print(f"eval ({len(eval_texts)} messages, threshold {jarvis.RELEVANCE_THRESHOLD}):")
+    evaluate(model, eval_texts, eval_labels, jarvis.RELEVANCE_THRESHOLD)
+
+    rng = np.random.default_rng(args.seed)
+    texts = [eval_texts[i] for i in rng.integers(len(eval_texts), size=args.messages)]
+    chars = sum(map(len, texts)) / len(texts)
+
+    model.scores(texts[:args.batch])  # warm up
+    elapsed = bench_scores(model, texts, args.batch)
+    rate = len(texts) / elapsed
+    verdict = "ok" if rate >= TARGET else "BELOW TARGET"
+    print(f"\nscores(): {len(texts)} messages (avg {chars:.0f} chars) in batches of {args.batch}: "
+          f"{elapsed:.2f}s, {rate:,.0f} msgs/s ({verdict}, target {TARGET:,})")
+
+    elapsed, batches = asyncio.run(bench_batcher(model, texts, args.batch))
+    print(f"batcher:  {batches} batches, {elapsed:.2f}s, {len(texts) / elapsed:,.0f} msgs/s")
+
+    started = time.perf_counter()
+    for text in texts:
+        jarvis.KEYWORD_RE.search(text.lower())
+    elapsed = time.perf_counter() - started
+    print(f"keywords: {len(texts) / elapsed:,.0f} msgs/s (for reference)")
+
+
+if __name__ == "__main__":
+    main()
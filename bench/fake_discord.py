@@ -0,0 +1,190 @@
+"""
+Just enough of discord.py's objects to drive jarvis's event handlers without a gateway.
+
+Every method that would be a REST call sleeps for `Rest.latency` and is counted in
+`Rest.calls` by name, so load tests can report how many API calls a scenario costs.
+"""
+import asyncio
+import itertools
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+_ids = itertools.count(10**17)
+
+
+class Rest:
+    """Counts (and optionally delays) fake API calls."""
+
+    latency = 0.0
+    calls = Counter()
+
+    @classmethod
+    async def call(cls, name: str):
+        cls.calls[name] += 1
+        if cls.latency:
+            await asyncio.sleep(cls.latency)
+
+    @classmethod
+    def reset(cls):
+        cls.calls = Counter()
+
+
+class FakeUser:
+    bot = False
+
+    def __init__(self, name: str, user_id: int = None, age_days: float = 400, guild=None):
+        self.id = user_id or next(_ids)
+        self.name = name
+        self.display_name = name
+        self.mention = f"<@{self.id}>"
+        self.guild = guild
+        self.created_at = datetime.now(timezone.utc) - timedelta(days=age_days)
+        self.joined_at = datetime.now(timezone.utc)
+        self.roles = []
+
+    def __str__(self):
+        return self.name
+
+    async def send(self, *args, **kwargs):
+        await Rest.call("dm")
+
+    async def add_roles(self, *roles, reason=None):
+        await Rest.call("add_roles")
+
+    async def kick(self, reason=None):
+        await Rest.call("kick")
+
+    async def move_to(self, channel):
+        await Rest.call("move")
+
+
+class FakeSentMessage:
+    def __init__(self, channel, content, on_update=None):
+        self.id = next(_ids)
+        self.channel = channel
+        self.content = content
+        self._on_update = on_update
+
+    async def edit(self, content=None, **kwargs):
+        await Rest.call("edit")
+        self.content = content
+        if self._on_update:
+            self._on_update()
+
+
+class _Typing:
+    async def __aenter__(self):
+        await Rest.call("typing")
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeChannel:
+    def __init__(self, guild, name: str, channel_id: int = None):
+        self.id = channel_id or next(_ids)
+        self.guild = guild
+        self.name = name
+        self.sent = 0
+        self.backlog = []  # messages history() returns, newest first
+
+    def typing(self):
+        return _Typing()
+
+    async def send(self, content=None, **kwargs):
+        await Rest.call("send")
+        self.sent += 1
+        return FakeSentMessage(self, content)
+
+    async def history(self, limit=None, oldest_first=False):
+        await Rest.call("history")
+        for message in self.backlog[:limit]:
+            yield message
+
+    async def purge(self, limit=None):
+        await Rest.call("purge")
+        return []
+
+
+class FakeInvite:
+    def __init__(self, code: str, inviter, uses: int = 0, max_uses: int = 0):
+        self.code = code
+        self.inviter = inviter
+        self.uses = uses
+        self.max_uses = max_uses
+
+
+class FakeGuild:
+    def __init__(self, name: str, guild_id: int = None):
+        self.id = guild_id or next(_ids)
+        self.name = name
+        self.features = []
+        self.roles = []
+        self.channels = {}
+        self.invites_by_code = {}
+        self.member_count = 0
+        self.approximate_member_count = None
+
+    def add_channel(self, name: str, channel_id: int = None) -> FakeChannel:
+        channel = FakeChannel(self, name, channel_id)
+        self.channels[channel.id] = channel
+        return channel
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    def get_member(self, user_id):
+        return None  # lite member cache: nothing is chunked
+
+    async def fetch_member(self, user_id):
+        await Rest.call("fetch_member")
+        return FakeUser(f"user{user_id}", user_id, guild=self)
+
+    async def invites(self):
+        await Rest.call("invites")
+        return [FakeInvite(i.code, i.inviter, i.uses, i.max_uses) for i in self.invites_by_code.values()]
+
+    async def ban(self, user, reason=None, delete_message_days=0):
+        await Rest.call("ban")
+
+    async def unban(self, user, reason=None):
+        await Rest.call("unban")
+
+
+class FakeMessage:
+    """An incoming message. `replied_at` is when its last reply was sent or edited (loop time)."""
+
+    _state = None  # commands.Context reads it; nothing else does without a command match
+
+    def __init__(self, channel: FakeChannel, author: FakeUser, content: str, mentions=()):
+        self.id = next(_ids)
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.mentions = list(mentions)
+        self.reference = None
+        self.replied_at = None
+
+    def _touch(self):
+        self.replied_at = asyncio.get_running_loop().time()
+
+    async def reply(self, content=None, mention_author=False, **kwargs):
+        await Rest.call("send")
+        self._touch()
+        return FakeSentMessage(self.channel, content, self._touch)
+
+
+def wire_bot(bot, guilds):
+    """Give the (never logged in) bot a user, and point bot.get_channel at the fake guilds' channels."""
+    bot._connection.user = FakeUser("Jarvis")
+    bot._connection.user.bot = True
+
+    def get_channel(channel_id):
+        for guild in guilds:
+            channel = guild.get_channel(channel_id)
+            if channel is not None:
+                return channel
+        return None
+    bot.get_channel = get_channel
+
@@ -0,0 +1,316 @@
+"""
+Replay synthetic Discord traffic through jarvis's event handlers, offline.
+
+    python bench/loadtest.py                                  # every scenario
+    python bench/loadtest.py --scenario conversation --events 400 --rate 40 --ttft 0.5
+
+No token or API key is needed. Messages and joins are fake discord objects (bench/fake_discord.py)
+fed to on_message / on_member_join at --rate events per second, AI calls go to a local stub
+of the Responses API (bench/stub_llm.py), and the database lives in a temporary directory.
+Each scenario runs in its own process so caches and buckets start cold. Reported per scenario:
+throughput, handler latency (on_message / on_member_join returning), reply latency (event to
+the last edit of the reply, or to the join being scored), AI requests, SQL statements run and
+REST calls by kind.
+
+Scenarios:
+  chatter       ordinary messages, nothing to answer
+  support       support questions that trip the auto-responder, mixed with chatter
+  conversation  "jarvis, ..." mentions answered through the AI queue
+  joins         bursts of joins through invites, then a raid
+  moderation    owner commands (warn, mute, kick by ID, cases)
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("OPENAI_API_KEY", "stub")  # jarvis only builds its client when a key is set
+from fake_discord import FakeGuild, FakeInvite, FakeMessage, FakeUser, Rest, wire_bot  # noqa: E402
+from stub_llm import StubLLM  # noqa: E402
+import jarvis  # noqa: E402
+from openai import AsyncOpenAI  # noqa: E402
+
+SCENARIOS = ("chatter", "support", "conversation", "joins", "moderation")
+DEFAULTS = {  # events, events per second
+    "chatter": (5000, 2000),
+    "support": (2000, 500),
+    "conversation": (200, 5),
+    "joins": (600, 100),
+    "moderation": (200, 20),
+}
+CHATTER = [
+    "lol that's wild", "good morning everyone", "anyone up for a match later?", "nice clip {name}",
+    "thanks for the help earlier!", "brb", "that was so helpful, appreciate it", "gg", "who's streaming tonight?",
+    "I'm debugging my own thing, ignore me", "haha same", "welcome {name}!",
+]
+SUPPORT = [
+    "the bot keeps crashing when I join the server", "getting an error: permission denied",
+    "how do I set up the ticket system?", "help, verification isn't working", "my script throws a nil value error",
+    "server crashed again after the update, any idea?", "can someone help me with the whitelist",
+]
+QUESTIONS = [
+    "what do you think about the new update?", "can you summarize what we talked about?",
+    "any tips for organizing the event?", "how's the server doing today?", "tell me something interesting",
+]
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class Harness:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.sql = Counter()
+        self.submitted = 0
+        self.handler_ms = []
+        self.reply_ms = []
+        self.guilds = [FakeGuild(f"Load Test {i}") for i in range(args.guilds)]
+        self.guild = self.guilds[0]  # where joins land
+        self.channels = [guild.add_channel(f"general-{i}") for guild in self.guilds for i in range(args.channels)]
+        for guild in self.guilds:
+            guild.add_channel("mod-log", jarvis.MOD_LOG_CHANNEL_ID)
+            guild.add_channel("invite-log", jarvis.INVITE_LOG_CHANNEL_ID)
+        self.users = [FakeUser(f"user{i}", guild=self.guild) for i in range(args.users)]
+        self.owner = FakeUser("owner", jarvis.OWNER_ID, guild=self.guild)
+
+    async def setup(self, stub_url):
+        jarvis.oai = AsyncOpenAI(api_key="stub", base_url=stub_url, timeout=jarvis.AI_TIMEOUT, max_retries=0)
+        jarvis.JOIN_DEBOUNCE = self.args.join_debounce
+        wire_bot(jarvis.bot, self.guilds)
+        await jarvis.init_db()
+        await jarvis.state.open()
+        await jarvis.warm_response_cache()
+        jarvis.load_relevance_model()
+        jarvis.ai_queue.start()
+        jarvis.log_sink.start()
+        for name, db in (("writer", jarvis.db_writer), ("reader", jarvis.db_reader), ("recall", jarvis.db_recall)):
+            await db.set_trace_callback(lambda sql, name=name: self.sql.update((name,)))
+
+        submit = jarvis.ai_queue.submit
+
+        def counting_submit(priority, job, on_drop=None, guild_id=None):
+            accepted = submit(priority, job, on_drop, guild_id)
+            self.submitted += accepted
+            return accepted
+        jarvis.ai_queue.submit = counting_submit
+
+    async def teardown(self):
+        jarvis.ai_queue.stop()
+        await jarvis.log_sink.close()
+        await jarvis.state.close()
+        await jarvis.close_db()
+        await jarvis.oai.close()
+
+    async def drain(self):
+        """Wait for queued AI jobs and background work (reconciles, log sends) to finish."""
+        queue = jarvis.ai_queue
+        while True:
+            done = queue.completed + queue.failed + queue.dropped_stale
+            if done >= self.submitted and not jarvis.background_tasks and not jarvis.pending_joins:
+                return
+            await asyncio.sleep(0.05)
+
+    def text(self, pool):
+        return self.rng.choice(pool).format(name=self.rng.choice(self.users).name)
+
+    def messages(self, scenario):
+        for i in range(self.args.events):
+            channel = self.rng.choice(self.channels)
+            author = self.rng.choice(self.users)
+            if scenario == "chatter":
+                yield FakeMessage(channel, author, self.text(CHATTER))
+            elif scenario == "support":
+                pool = SUPPORT if self.rng.random() < 0.3 else CHATTER
+                yield FakeMessage(channel, author, self.text(pool))
+            elif scenario == "conversation":
+                yield FakeMessage(channel, author, f"jarvis, {self.rng.choice(QUESTIONS)}")
+            elif scenario == "moderation":
+                target = self.rng.choice(self.users)
+                verb = self.rng.choice(["warn", "mute", "kick", "cases"])
+                if verb == "mute":
+                    yield FakeMessage(channel, self.owner, f"jarvis mute <@{target.id}>", mentions=[target])
+                else:
+                    yield FakeMessage(channel, self.owner, f"jarvis {verb} {target.id} for load testing")
+
+    async def handle_message(self, message):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await jarvis.on_message(message)
+        self.handler_ms.append((loop.time() - started) * 1000)
+        return started
+
+    async def run_messages(self, scenario):
+        loop = asyncio.get_running_loop()
+        messages = list(self.messages(scenario))
+        tasks = []
+        begin = loop.time()
+        for i, message in enumerate(messages):
+            delay = begin + i / self.args.rate - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(self.handle_message(message)))
+        starts = await asyncio.gather(*tasks)
+        await self.drain()
+        for message, started in zip(messages, starts):
+            if message.replied_at is not None:
+                self.reply_ms.append((message.replied_at - started) * 1000)
+        return len(messages), loop.time() - begin
+
+    async def run_joins(self):
+        """Organic joins through a handful of invites, with the last third arriving as a raid."""
+        loop = asyncio.get_running_loop()
+        invites = [FakeInvite(f"code{i}", self.rng.choice(self.users)) for i in range(8)]
+        raid_invite = FakeInvite("raid", FakeUser("raider-host"))
+        for invite in invites + [raid_invite]:
+            self.guild.invites_by_code[invite.code] = invite
+        await jarvis.prime_invites(self.guild)
+
+        joined_at = {}
+        check_raid = jarvis.check_raid
+
+        async def timed_check_raid(member, used):
+            await check_raid(member, used)
+            self.reply_ms.append((loop.time() - joined_at[member.id]) * 1000)
+        jarvis.check_raid = timed_check_raid
+
+        raid_from = self.args.events * 2 // 3
+        begin = loop.time()
+        for i in range(self.args.events):
+            delay = begin + i / self.args.rate - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if i < raid_from:
+                member = FakeUser(f"member{i}", age_days=self.rng.randint(30, 2000), guild=self.guild)
+                invite = self.rng.choice(invites)
+            else:
+                member = FakeUser(f"raider{self.rng.randint(0, 9999)}", age_days=0, guild=self.guild)
+                invite = raid_invite
+            invite.uses += 1
+            joined_at[member.id] = loop.time()
+            started = loop.time()
+            await jarvis.on_member_join(member)
+            self.handler_ms.append((loop.time() - started) * 1000)
+        await self.drain()
+        return self.args.events, loop.time() - begin
+
+    async def run(self, scenario):
+        stub = StubLLM(self.args.ttft, self.args.token_delay, self.args.tokens, self.args.error_rate)
+        url = await stub.start()
+        await self.setup(url)
+        Rest.reset()
+        self.sql.clear()
+        try:
+            if scenario == "joins":
+                events, elapsed = await self.run_joins()
+            else:
+                events, elapsed = await self.run_messages(scenario)
+            await jarvis.log_sink.flush()
+        finally:
+            await self.teardown()
+            await stub.close()
+        return {
+            "scenario": scenario,
+            "events": events,
+            "seconds": elapsed,
+            "throughput": events / elapsed if elapsed else 0.0,
+            "handler_p50_ms": percentile(self.handler_ms, 0.5),
+            "handler_p99_ms": percentile(self.handler_ms, 0.99),
+            "replies": len(self.reply_ms),
+            "reply_p50_ms": percentile(self.reply_ms, 0.5),
+            "reply_p99_ms": percentile(self.reply_ms, 0.99),
+            "ai_requests": stub.requests,
+            "ai_rejected": stub.rejected,
+            "sql": dict(self.sql),
+            "rest": dict(Rest.calls),
+        }
+
+
+def run_one(args):
+    """Run one scenario in this process and print its result as a JSON line."""
+    events, rate = DEFAULTS[args.scenario]
+    args.events = args.events or events
+    args.rate = args.rate or rate
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        # jarvis reports every AI request and startup step; keep the report readable.
+        with contextlib.redirect_stdout(io.StringIO()) if not args.verbose else contextlib.nullcontext():
+            result = asyncio.run(Harness(args).run(args.scenario))
+    print(json.dumps(result))
+
+
+def report(result):
+    sql = ", ".join(f"{name} {count}" for name, count in sorted(result["sql"].items())) or "none"
+    rest = ", ".join(f"{name} {count}" for name, count in sorted(result["rest"].items())) or "none"
+    replies = (
+        f"replies {result['replies']} p50 {result['reply_p50_ms']:.0f}ms p99 {result['reply_p99_ms']:.0f}ms"
+        if result["replies"] else "replies 0"
+    )
+    print(
+        f"{result['scenario']:<13} {result['events']} events in {result['seconds']:.1f}s "
+        f"({result['throughput']:,.0f}/s) | handler p50 {result['handler_p50_ms']:.2f}ms "
+        f"p99 {result['handler_p99_ms']:.2f}ms | {replies}\n"
+        f"{'':<13} AI requests {result['ai_requests']} ({result['ai_rejected']} rejected) | "
+        f"SQL {sql} | REST {rest}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=SCENARIOS + ("all",), default="all")
+    parser.add_argument("--events", type=int, help="events to replay (default per scenario)")
+    parser.add_argument("--rate", type=float, help="events per second (default per scenario)")
+    parser.add_argument("--guilds", type=int, default=4, help="AI concurrency is also capped per guild")
+    parser.add_argument("--channels", type=int, default=10, help="channels per guild")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--ttft", type=float, default=0.3, help="stub LLM seconds to first token")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="stub LLM seconds between tokens")
+    parser.add_argument("--tokens", type=int, default=40, help="stub LLM tokens per reply")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of LLM requests answered with 429")
+    parser.add_argument("--rest-latency", type=float, default=0.0, help="seconds each fake REST call takes")
+    parser.add_argument("--join-debounce", type=float, default=jarvis.JOIN_DEBOUNCE)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print raw JSON results")
+    parser.add_argument("--verbose", action="store_true", help="keep jarvis's own output")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    Rest.latency = args.rest_latency
+    if args.child:
+        run_one(args)
+        return
+
+    scenarios = SCENARIOS if args.scenario == "all" else (args.scenario,)
+    for scenario in scenarios:
+        command = [sys.executable, os.path.abspath(__file__), "--child", "--scenario", scenario]
+        for name, value in vars(args).items():
+            if name in ("scenario", "json", "child") or value is None or value is False:
+                continue
+            command += [f"--{name.replace('_', '-')}"] + ([] if value is True else [str(value)])
+        started = time.perf_counter()
+        output = subprocess.run(command, capture_output=True, text=True)
+        if output.returncode != 0:
+            print(f"{scenario:<13} failed after {time.perf_counter() - started:.1f}s:\n{output.stderr[-2000:]}")
+            continue
+        result = json.loads(output.stdout.strip().splitlines()[-1])
+        if args.json:
+            print(json.dumps(result))
+        else:
+            report(result)
+
+
+if __name__ == "__main__":
+    main()
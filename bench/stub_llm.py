@@ -0,0 +1,156 @@
+"""
+A local stand-in for the OpenAI Responses API, for load tests that must not spend tokens.
+
+    python bench/stub_llm.py --port 8089 --ttft 0.4 --token-delay 0.02
+
+Serves POST /v1/responses as JSON or, with "stream": true, as server-sent events, after a
+configurable time-to-first-token and per-token delay. --error-rate answers that share of
+requests with 429 so the client's retry path is exercised too.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+WORDS = (
+    "Certainly. The logs point to a missing dependency; reinstall it, restart the service and "
+    "check the permissions on the config directory before trying again."
+).split()
+
+
+class StubLLM:
+    def __init__(self, ttft: float = 0.3, token_delay: float = 0.01, tokens: int = 40, error_rate: float = 0.0):
+        self.ttft = ttft
+        self.token_delay = token_delay
+        self.tokens = tokens
+        self.error_rate = error_rate
+        self.requests = 0
+        self.streamed = 0
+        self.rejected = 0
+        self.server = None
+        self.port = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        self.server = await asyncio.start_server(self._serve, host, port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return f"http://{host}:{self.port}/v1"
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _serve(self, reader, writer):
+        try:
+            while True:  # keep-alive: the client reuses connections from its pool
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode().partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                await self._handle(request_line.decode().split(), body, writer)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass  # client went away, or the loop is shutting down
+        finally:
+            writer.close()
+
+    async def _handle(self, request_line, body, writer):
+        method, path = request_line[0], request_line[1]
+        if method != "POST" or not path.endswith("/responses"):
+            self._write(writer, 404, {"error": {"message": "not found"}})
+            return
+        self.requests += 1
+        payload = json.loads(body or b"{}")
+        if random.random() < self.error_rate:
+            self.rejected += 1
+            self._write(writer, 429, {"error": {"message": "rate limited", "type": "rate_limit"}}, {"retry-after": "0"})
+            return
+        prompt_tokens = sum(len(str(item.get("content", ""))) for item in payload.get("input", [])) // 4
+        words = [WORDS[i % len(WORDS)] for i in range(self.tokens)]
+        usage = {
+            "input_tokens": prompt_tokens,
+            "input_tokens_details": {"cached_tokens": 0},
+            "output_tokens": len(words),
+            "output_tokens_details": {"reasoning_tokens": 0},
+            "total_tokens": prompt_tokens + len(words),
+        }
+        await asyncio.sleep(self.ttft)
+        if not payload.get("stream"):
+            await asyncio.sleep(self.token_delay * len(words))
+            self._write(writer, 200, self._response(payload, " ".join(words), usage))
+            return
+
+        self.streamed += 1
+        writer.write(
+            b"HTTP/1.1 200 OK\r\ncontent-type: text/event-stream\r\ntransfer-encoding: chunked\r\n\r\n"
+        )
+        sequence = 0
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(self.token_delay)
+            delta = word if i == 0 else " " + word
+            self._event(writer, {
+                "type": "response.output_text.delta", "item_id": "msg_stub", "output_index": 0,
+                "content_index": 0, "delta": delta, "logprobs": [], "sequence_number": sequence,
+            })
+            sequence += 1
+            await writer.drain()
+        self._event(writer, {
+            "type": "response.completed", "sequence_number": sequence,
+            "response": self._response(payload, " ".join(words), usage),
+        })
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    @staticmethod
+    def _response(payload, text, usage):
+        return {
+            "id": "resp_stub", "object": "response", "created_at": int(time.time()), "status": "completed",
+            "model": payload.get("model", "stub"), "parallel_tool_calls": False, "tool_choice": "auto", "tools": [],
+            "output": [{
+                "type": "message", "id": "msg_stub", "role": "assistant", "status": "completed",
+                "content": [{"type": "output_text", "text": text, "annotations": []}],
+            }],
+            "usage": usage,
+        }
+
+    @staticmethod
+    def _event(writer, event):
+        data = f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode()
+        writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+    @staticmethod
+    def _write(writer, status, body, headers=None):
+        data = json.dumps(body).encode()
+        extra = "".join(f"{name}: {value}\r\n" for name, value in (headers or {}).items())
+        writer.write(
+            f"HTTP/1.1 {status} STUB\r\ncontent-type: application/json\r\ncontent-length: {len(data)}\r\n{extra}\r\n".encode()
+            + data
+        )
+
+
+async def serve(args):
+    stub = StubLLM(args.ttft, args.token_delay, args.tokens, args.error_rate)
+    url = await stub.start(port=args.port)
+    print(f"Stub LLM at {url} (set OPENAI_BASE_URL to it)")
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--ttft", type=float, default=0.3, help="seconds before the first token")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="seconds between streamed tokens")
+    parser.add_argument("--tokens", type=int, default=40, help="tokens per reply")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 429")
+    asyncio.run(serve(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
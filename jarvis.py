@@ -1,13 +1,34 @@
 import os
+import sys
 import time
+import random
+import re
+import json
+import hashlib
+import zlib
+import shutil
 import tempfile
 import sqlite3
+import subprocess
 import asyncio  # for async status rotation
+import contextlib
+import heapq
+import itertools
+import functools
+import bisect
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone
+import numpy as np
 import discord
 import aiosqlite
 from discord.ext import commands, tasks
 from discord import app_commands, FFmpegPCMAudio
-from openai import OpenAI
+try:
+    import tiktoken  # optional: exact token counts; without it tokens are estimated as characters / 4
+except ImportError:
+    tiktoken = None
+from openai import AsyncOpenAI, APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
 
 # =======================
 # CONFIG
@@ -17,142 +38,1245 @@ OWNER_ID = 1176071547476262986
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-oai = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+# AI request limits
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "8"))      # in-flight requests across all guilds
+AI_GUILD_CONCURRENCY = int(os.getenv("AI_GUILD_CONCURRENCY", "2"))  # in-flight requests per guild
+AI_TIMEOUT = float(os.getenv("AI_TIMEOUT", "30"))                   # seconds per attempt
+AI_MAX_RETRIES = int(os.getenv("AI_MAX_RETRIES", "3"))              # retries on 429/5xx/timeouts
+AI_BACKOFF_BASE = 0.5                                               # seconds, doubled per attempt
+AI_BACKOFF_MAX = 8.0
+AI_WORKERS = int(os.getenv("AI_WORKERS", str(AI_MAX_CONCURRENCY)))  # reply jobs running at once
+AI_QUEUE_SIZE = int(os.getenv("AI_QUEUE_SIZE", "200"))              # queued reply jobs before shedding
+AI_STREAMING = os.getenv("AI_STREAMING", "1") == "1"                # post and edit replies as they generate
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.2"))  # seconds between in-place edits
+MESSAGE_LIMIT = 1900                                                # characters per Discord message we send
+
+# Prompt budgets, in tokens
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1500"))    # whole input: persona, memory, history, message
+PROMPT_MESSAGE_TOKENS = int(os.getenv("PROMPT_MESSAGE_TOKENS", "600"))  # the message being answered
+PROMPT_LINE_TOKENS = int(os.getenv("PROMPT_LINE_TOKENS", "200"))        # each history or recalled line
+PROMPT_RECALL_SHARE = 0.3                                               # of the history budget given to recall
+
+# One shared client (and connection pool) for the whole process; retries are handled in ai_reply.
+oai = AsyncOpenAI(api_key=OPENAI_API_KEY, timeout=AI_TIMEOUT, max_retries=0) if OPENAI_API_KEY else None
+ai_slots = asyncio.Semaphore(AI_MAX_CONCURRENCY)
+ai_guild_slots = {}  # guild_id -> asyncio.Semaphore
 
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
 intents.voice_states = True
 
-bot = commands.Bot(command_prefix="!", intents=intents)
+# Member cache: "full" chunks every guild at startup and keeps all members; "lite" skips chunking and
+# keeps only recently active or moderated members in an LRU, fetching others on demand.
+MEMBER_CACHE_MODE = os.getenv("MEMBER_CACHE_MODE", "lite")
+MEMBER_LRU_SIZE = int(os.getenv("MEMBER_LRU_SIZE", "5000"))
+MEMBER_LRU_TTL = float(os.getenv("MEMBER_LRU_TTL", "900"))  # seconds before a cached member is refetched
+if MEMBER_CACHE_MODE == "lite":
+    # Voice members stay cached: they are few and lockdown/move need their state.
+    member_options = {"chunk_guilds_at_startup": False, "member_cache_flags": discord.MemberCacheFlags(voice=True, joined=False)}
+else:
+    member_options = {}
+
+# Sharding: SHARD_COUNT > 0 runs an AutoShardedBot; SHARD_IDS picks this process's shards (launcher sets both)
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0"))
+SHARD_IDS = [int(i) for i in os.getenv("SHARD_IDS", "").split(",") if i.strip()] or None
+CLUSTER_ID = int(os.getenv("CLUSTER_ID", "0"))  # cluster 0 owns DB maintenance and command sync
+CLUSTER_COUNT = int(os.getenv("CLUSTER_COUNT", "1"))  # processes the launcher splits SHARD_COUNT across
+IDENTIFY_INTERVAL = 5.5  # seconds per shard between cluster starts (one IDENTIFY per 5s per bot)
+
+if SHARD_COUNT:
+    bot = commands.AutoShardedBot(
+        command_prefix="!", intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS, **member_options
+    )
+else:
+    bot = commands.Bot(command_prefix="!", intents=intents, **member_options)
 start_time = time.time()
 
+# Cross-shard state (cooldowns, conversation windows, kill switch): "memory" for one process, "sqlite" for clusters
+STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite" if SHARD_COUNT else "memory")
+STATE_FILE = os.getenv("STATE_FILE", "state.db")
+KILL_SWITCH_TTL = 5.0  # seconds a shard may go on acting on a stale kill switch
+
 DB_FILE = "memory.db"
+ARCHIVE_FILE = "memory_archive.db"
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
 
 # Channel IDs
 INVITE_LOG_CHANNEL_ID = 1422164192156454932   # Invite logs
 MOD_LOG_CHANNEL_ID = 1422571435762909234      # Mod actions
 
-invite_cache = {}
+invite_cache = {}     # guild_id -> {code: Invite}, kept current by invite events and join reconciles
+vanity_uses = {}      # guild_id -> uses of the vanity URL at the last fetch
+deleted_invites = {}  # guild_id -> {code: (deleted_at, Invite)} awaiting the next reconcile
+pending_joins = {}    # guild_id -> members waiting for invite attribution
+JOIN_DEBOUNCE = float(os.getenv("JOIN_DEBOUNCE", "2"))  # seconds a burst of joins is gathered for one fetch
 last_role_channel = None
-global_kill_switch = False
 
 # Jarvis awareness and cooldown
 IMPORTANT_KEYWORDS = ["error", "crash", "issue", "bug", "help", "setup", "urgent"]
-last_response_time = 0
-RESPONSE_COOLDOWN = 60  # seconds between automated responses
-
-# Conversation tracking
-last_jarvis_message = {}  # channel_id -> (timestamp, user_id)
+KEYWORD_RE = re.compile("|".join(map(re.escape, IMPORTANT_KEYWORDS)))  # fallback trigger when there's no model
+RELEVANCE_MODEL = os.getenv("RELEVANCE_MODEL", os.path.join(os.path.dirname(os.path.abspath(__file__)), "models", "relevance.npz"))
+RELEVANCE_THRESHOLD = float(os.getenv("RELEVANCE_THRESHOLD", "0.5"))  # default; per guild with "jarvis threshold"
+RELEVANCE_BATCH_SIZE = 512   # messages scored in one pass
+RELEVANCE_BATCH_MS = 2.0     # longest a message waits for others to batch with
+RESPONSE_COOLDOWN = 60  # seconds between automated responses in a channel
+
+# Automated response token buckets: burst size and seconds to refill one token
+AUTO_GUILD_BURST = int(os.getenv("AUTO_GUILD_BURST", "3"))
+AUTO_GUILD_REFILL = float(os.getenv("AUTO_GUILD_REFILL", "30"))
+AUTO_CHANNEL_BURST = int(os.getenv("AUTO_CHANNEL_BURST", "1"))
+AUTO_CHANNEL_REFILL = float(os.getenv("AUTO_CHANNEL_REFILL", str(RESPONSE_COOLDOWN)))
+AUTO_USER_BURST = int(os.getenv("AUTO_USER_BURST", "1"))
+AUTO_USER_REFILL = float(os.getenv("AUTO_USER_REFILL", "120"))
+
+# Cached auto-responses, per guild, keyed on normalized message text
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "2000"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "86400"))          # seconds an answer is reused
+RESPONSE_CACHE_FUZZY = os.getenv("RESPONSE_CACHE_FUZZY", "1") == "1"          # also match near-duplicates
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.8"))  # estimated Jaccard to reuse
+
+# Conversation tracking (state key "conversation:<channel_id>" -> user_id)
 CONVERSATION_WINDOW = 60  # seconds allowed for follow-up messages
 
+# Channel context kept from the gateway
+CONTEXT_SIZE = 6                                                      # messages per channel
+CONTEXT_MAX_CHANNELS = int(os.getenv("CONTEXT_MAX_CHANNELS", "2000"))  # channels kept in memory
+CONTEXT_IDLE_TTL = float(os.getenv("CONTEXT_IDLE_TTL", "3600"))       # seconds before an idle channel is dropped
+CONTEXT_MAX_CHARS = 2000                                              # per stored message
+
+
+# =======================
+# METRICS
+# =======================
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))           # Prometheus text on 127.0.0.1:PORT+CLUSTER_ID; 0 is off
+METRICS_PROFILE = os.getenv("METRICS_PROFILE", "0") == "1"    # start the sampling profiler with the bot
+PROFILE_INTERVAL = 0.005                                     # seconds between profiler samples
+PROFILE_MAX_STACKS = 5000                                    # distinct sampled stacks kept
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)  # seconds
+
+
+class Histogram:
+    """Latency counts in fixed buckets, so memory stays constant however many observations arrive."""
+
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)  # the last bucket is +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th observation (the +Inf bucket reports the last bound)."""
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return LATENCY_BUCKETS[min(i, len(LATENCY_BUCKETS) - 1)]
+        return 0.0
+
+
+class Metrics:
+    """Counters and latency histograms keyed by (name, op)."""
+
+    def __init__(self):
+        self.counters = {}    # (name, op) -> int
+        self.histograms = {}  # (name, op) -> Histogram
+
+    def inc(self, name: str, op: str = "", value: int = 1):
+        key = (name, op)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, op: str, seconds: float):
+        histogram = self.histograms.get((name, op))
+        if histogram is None:
+            histogram = self.histograms[(name, op)] = Histogram()
+        histogram.observe(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name: str, op: str):
+        """Time the block under `name`; exceptions are counted in `name`_errors and re-raised."""
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc(f"{name}_errors", op)
+            raise
+        finally:
+            self.observe(name, op, time.perf_counter() - started)
+
+    def slowest(self, name: str, limit: int = 5) -> list:
+        """(op, Histogram) for `name`, highest p99 first."""
+        found = [(op, h) for (n, op), h in self.histograms.items() if n == name and h.count]
+        return sorted(found, key=lambda item: item[1].quantile(0.99), reverse=True)[:limit]
+
+    def prometheus(self) -> str:
+        lines = []
+        for (name, op), value in sorted(self.counters.items()):
+            if not lines or not lines[-1].startswith(f"jarvis_{name}_total{{"):
+                lines.append(f"# TYPE jarvis_{name}_total counter")
+            lines.append(f'jarvis_{name}_total{{op="{op}"}} {value}')
+        family = None
+        for (name, op), histogram in sorted(self.histograms.items()):
+            if name != family:
+                family = name
+                lines.append(f"# TYPE jarvis_{name}_seconds histogram")
+            cumulative = 0
+            for bound, n in zip(LATENCY_BUCKETS + ("+Inf",), histogram.counts):
+                cumulative += n
+                lines.append(f'jarvis_{name}_seconds_bucket{{op="{op}",le="{bound}"}} {cumulative}')
+            lines.append(f'jarvis_{name}_seconds_sum{{op="{op}"}} {histogram.total:.6f}')
+            lines.append(f'jarvis_{name}_seconds_count{{op="{op}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def timed(name: str):
+    """Record an async function's latency and errors under `name`, with the function name as op."""
+    def decorate(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with metrics.timer(name, func.__name__):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+async def serve_metrics(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Minimal HTTP responder: every request gets the Prometheus text exposition."""
+    try:
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass  # request line and headers are ignored
+        body = metrics.prometheus().encode()
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+            b"Content-Length: %d\r\nConnection: close\r\n\r\n%s" % (len(body), body)
+        )
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server():
+    if not METRICS_PORT:
+        return
+    # Each cluster is its own process with its own metrics, so each gets its own port.
+    port = METRICS_PORT + CLUSTER_ID
+    try:
+        await asyncio.start_server(serve_metrics, "127.0.0.1", port)
+    except OSError as e:
+        print(f"⚠️ Metrics server not started on port {port}: {e}")
+        return
+    print(f"📈 Metrics at http://127.0.0.1:{port}/metrics")
+
+
+class SamplingProfiler:
+    """
+    Samples the event loop thread's stack every PROFILE_INTERVAL from a background thread.
+    Costs nothing while stopped; counts are kept per leaf function and per (bounded) stack.
+    """
+
+    def __init__(self):
+        self.samples = 0
+        self.leaves = {}  # "file:line function" -> samples
+        self.stacks = {}  # stack tuple -> samples
+        self._target = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self.samples = 0
+        self.leaves, self.stacks = {}, {}
+        self._target = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(PROFILE_INTERVAL):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None and len(stack) < 30:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{frame.f_lineno} {code.co_name}")
+                frame = frame.f_back
+            if not stack:
+                continue
+            self.samples += 1
+            self.leaves[stack[0]] = self.leaves.get(stack[0], 0) + 1
+            key = tuple(stack)
+            if key in self.stacks or len(self.stacks) < PROFILE_MAX_STACKS:
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def top(self, limit: int = 15) -> list:
+        """(share of samples, leaf frame), busiest first. An idle loop shows up in the selector's select()."""
+        ranked = sorted(self.leaves.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [(n / self.samples, leaf) for leaf, n in ranked] if self.samples else []
+
+
+profiler = SamplingProfiler()
+
 
 # =======================
 # DATABASE
 # =======================
+def _latest_backup():
+    if not os.path.isdir(BACKUP_DIR):
+        return None
+    snapshots = sorted(name for name in os.listdir(BACKUP_DIR) if name.endswith(".db"))
+    return os.path.join(BACKUP_DIR, snapshots[-1]) if snapshots else None
+
+
 def reset_bad_db():
-    if os.path.exists(DB_FILE):
+    """Set a corrupted DB aside and restore the newest backup, or start fresh if there is none."""
+    if not os.path.exists(DB_FILE):
+        return
+    try:
+        conn = sqlite3.connect(DB_FILE)
         try:
-            conn = sqlite3.connect(DB_FILE)
-            conn.execute("SELECT name FROM sqlite_master WHERE type='table';")
+            healthy = conn.execute("PRAGMA quick_check").fetchone()[0] == "ok"
+        finally:
             conn.close()
-        except sqlite3.DatabaseError:
-            os.remove(DB_FILE)
-            print("⚠️ Corrupted DB deleted, rebuilding...")
+    except sqlite3.DatabaseError:
+        healthy = False
+    if healthy:
+        return
+
+    corrupt = f"{DB_FILE}.corrupt-{int(time.time())}"
+    os.replace(DB_FILE, corrupt)
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(DB_FILE + suffix):
+            os.replace(DB_FILE + suffix, corrupt + suffix)
+    snapshot = _latest_backup()
+    if snapshot:
+        shutil.copyfile(snapshot, DB_FILE)
+        print(f"⚠️ Corrupted DB moved to {corrupt}, restored {snapshot}.")
+    else:
+        print(f"⚠️ Corrupted DB moved to {corrupt}, rebuilding...")
+
+
+DB_BATCH_SIZE = int(os.getenv("DB_BATCH_SIZE", "50"))  # memory rows per commit
+DB_FLUSH_MS = int(os.getenv("DB_FLUSH_MS", "500"))      # max time a memory row waits for its commit
+DB_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=67108864",
+    "PRAGMA busy_timeout=5000",
+)
+
+MEMORY_RETENTION_DAYS = int(os.getenv("MEMORY_RETENTION_DAYS", "90"))  # older rows move to ARCHIVE_FILE
+MAINTENANCE_HOURS = float(os.getenv("MAINTENANCE_HOURS", "6"))          # archive/vacuum/backup interval
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))                        # snapshots kept in BACKUP_DIR
+ARCHIVE_BATCH = 5000                                                    # rows archived per transaction
+VACUUM_PAGES = 2000                                                     # free pages returned per run
+
+ARCHIVE_SCHEMA = (
+    # One row per (channel, month) chunk of archived memory; payload is zlib-compressed JSON rows.
+    """
+    CREATE TABLE IF NOT EXISTS archive.memory_archive (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        channel_id INTEGER,
+        month TEXT,
+        first_id INTEGER,
+        last_id INTEGER,
+        row_count INTEGER,
+        payload BLOB
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS archive.idx_memory_archive_channel_month ON memory_archive (channel_id, month)",
+)
+
+PREF_CACHE_SIZE = int(os.getenv("PREF_CACHE_SIZE", "5000"))  # cached user_prefs/settings rows
+PREF_CACHE_TTL = float(os.getenv("PREF_CACHE_TTL", "600"))   # seconds before a cached row is re-read
+
+RECALL_TOP_K = int(os.getenv("RECALL_TOP_K", "3"))               # past lines added to a prompt
+RECALL_BUDGET_MS = float(os.getenv("RECALL_BUDGET_MS", "8"))     # recall queries are aborted past this
+RECALL_MAX_TERMS = 8
+RECALL_WINDOW = 5000     # only the user's most recent rows in a channel are searched
+RECALL_CANDIDATES = 50   # newest matches re-ranked by how many query terms they share
+RECALL_COMMON_FRACTION = 0.003  # terms in more rows than this are skipped like stopwords...
+RECALL_COMMON_MIN_ROWS = 5000   # ...once they appear in at least this many rows
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS memory (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        channel_id INTEGER,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        content TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS user_prefs (
+        user_id INTEGER PRIMARY KEY,
+        preferred_title TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS settings (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )
+    """,
+    # Permission state from before a lockdown, restored exactly by unlock. For channels `existed` says
+    # whether @everyone had an overwrite (allow/deny hold it); for threads it is the old `locked` flag.
+    """
+    CREATE TABLE IF NOT EXISTS lockdown_snapshot (
+        guild_id INTEGER,
+        channel_id INTEGER,
+        kind TEXT,
+        existed INTEGER,
+        allow INTEGER,
+        deny INTEGER,
+        PRIMARY KEY (guild_id, channel_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS mod_cases (
+        case_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        guild_id INTEGER,
+        action TEXT,
+        target_id INTEGER,
+        target TEXT,
+        moderator_id INTEGER,
+        reason TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_mod_cases_guild_target ON mod_cases (guild_id, target_id)",
+    # Log embeds that couldn't be sent yet (rate limited, Discord down, shutting down).
+    """
+    CREATE TABLE IF NOT EXISTS log_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        channel_id INTEGER,
+        embed TEXT,
+        guild_id INTEGER
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS response_cache (
+        guild_id INTEGER,
+        text TEXT,
+        reply TEXT,
+        expires REAL,
+        PRIMARY KEY (guild_id, text)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_memory_user_channel_time ON memory (user_id, channel_id, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_memory_channel_time ON memory (channel_id, timestamp)",
+    # Contentless full-text index over memory. `scope` holds one "u<user>c<channel>" token per row,
+    # so a recall query intersects the user's own posting list instead of filtering every match.
+    "CREATE VIRTUAL TABLE IF NOT EXISTS memory_fts USING fts5(scope, content, content='')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS memory_vocab USING fts5vocab(memory_fts, 'row')",
+    """
+    CREATE TRIGGER IF NOT EXISTS memory_fts_insert AFTER INSERT ON memory BEGIN
+        INSERT INTO memory_fts (rowid, scope, content)
+        VALUES (new.id, 'u' || new.user_id || 'c' || new.channel_id, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS memory_fts_delete AFTER DELETE ON memory BEGIN
+        INSERT INTO memory_fts (memory_fts, rowid, scope, content)
+        VALUES ('delete', old.id, 'u' || old.user_id || 'c' || old.channel_id, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS memory_fts_update AFTER UPDATE ON memory BEGIN
+        INSERT INTO memory_fts (memory_fts, rowid, scope, content)
+        VALUES ('delete', old.id, 'u' || old.user_id || 'c' || old.channel_id, old.content);
+        INSERT INTO memory_fts (rowid, scope, content)
+        VALUES (new.id, 'u' || new.user_id || 'c' || new.channel_id, new.content);
+    END
+    """,
+)
+
+MEMORY_FTS_BACKFILL = """
+    INSERT INTO memory_fts (rowid, scope, content)
+    SELECT id, 'u' || user_id || 'c' || channel_id, content FROM memory
+"""
+
+# Candidates are the newest matching rows, read in rowid order so FTS5 can stop after :limit
+# without scoring every match (bm25 would scan each term's whole doclist for its IDF). The rowid
+# floor, found through idx_memory_user_channel_time, bounds the scan for very active users.
+RECALL_SQL = f"""
+    SELECT m.content FROM memory_fts JOIN memory m ON m.id = memory_fts.rowid
+    WHERE memory_fts MATCH :query
+      AND memory_fts.rowid >= coalesce((
+          SELECT id FROM memory WHERE user_id = :user_id AND channel_id = :channel_id
+          ORDER BY timestamp DESC LIMIT 1 OFFSET {RECALL_WINDOW}
+      ), 0)
+    ORDER BY memory_fts.rowid DESC
+    LIMIT :limit
+"""
+
+# Very common terms match a large share of all rows, and seeking through their doclists is what
+# makes recall slow on a big table, while they say little about relevance. They are found once
+# per refresh from the vocabulary table and then dropped from queries.
+COMMON_TERMS_SQL = """
+    SELECT term FROM memory_vocab
+    WHERE doc > max(?, (SELECT count(*) FROM memory) * ?)
+"""
+
+RECALL_STOPWORDS = frozenset(
+    "the and for you your are but not this that with have what when where which who why how can "
+    "could would should will just like was were been from they them then than there their about "
+    "into out get got its it's did does don't yes jarvis".split()
+)
+_WORD_RE = re.compile(r"\w{3,}")
+
+# One long-lived writer plus one reader; WAL lets reads run while a batch is committing.
+# Recall has its own reader so its latency budget can't abort anyone else's query.
+db_writer = None
+db_reader = None
+db_recall = None
+_recall_deadline = 0.0
+recall_lock = asyncio.Lock()  # one recall at a time, so each query runs under its own deadline
+recall_common_terms = frozenset()
+db_write_lock = asyncio.Lock()
+memory_queue = asyncio.Queue()
+memory_writer_task = None
+
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Bounded LRU mapping whose entries expire `ttl` seconds after they were set."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (expires_at, value)
+
+    def get(self, key, default=_MISSING):
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+# Absent rows are cached as None so users without a preference don't hit the DB either.
+pref_cache = TTLCache(PREF_CACHE_SIZE, PREF_CACHE_TTL)
+settings_cache = TTLCache(PREF_CACHE_SIZE, PREF_CACHE_TTL)
+
+
+async def _connect_db():
+    db = await aiosqlite.connect(DB_FILE)
+    try:
+        for pragma in DB_PRAGMAS:
+            await db.execute(pragma)
+    except Exception:
+        await db.close()
+        raise
+    return db
 
 
 async def init_db():
-    async with aiosqlite.connect(DB_FILE) as db:
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS memory (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                channel_id INTEGER,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                content TEXT
-            )
-        """)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS user_prefs (
-                user_id INTEGER PRIMARY KEY,
-                preferred_title TEXT
-            )
-        """)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS settings (
-                key TEXT PRIMARY KEY,
-                value TEXT
-            )
-        """)
-        await db.commit()
+    global db_writer, db_reader, db_recall, memory_writer_task
+    db_writer = await _connect_db()
+    async with db_writer.execute("PRAGMA auto_vacuum") as cursor:
+        if (await cursor.fetchone())[0] != 2:
+            # Incremental auto-vacuum only takes effect after a VACUUM; instant on a new database.
+            await db_writer.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            await db_writer.execute("VACUUM")
+    async with db_writer.execute(
+        "SELECT 1 FROM sqlite_master WHERE name='memory_fts'"
+    ) as cursor:
+        fts_exists = await cursor.fetchone() is not None
+    for statement in SCHEMA:
+        await db_writer.execute(statement)
+    async with db_writer.execute("PRAGMA table_info(log_outbox)") as cursor:
+        if "guild_id" not in [row[1] for row in await cursor.fetchall()]:
+            await db_writer.execute("ALTER TABLE log_outbox ADD COLUMN guild_id INTEGER")
+    await db_writer.execute("ATTACH DATABASE ? AS archive", (ARCHIVE_FILE,))
+    await db_writer.execute("PRAGMA archive.journal_mode=WAL")
+    for statement in ARCHIVE_SCHEMA:
+        await db_writer.execute(statement)
+    if not fts_exists:
+        await db_writer.execute(MEMORY_FTS_BACKFILL)
+    await db_writer.commit()
+    db_reader = await _connect_db()
+    db_recall = await _connect_db()
+    await db_recall.set_progress_handler(_recall_over_budget, 1000)
+    memory_writer_task = asyncio.create_task(_memory_writer())
+    asyncio.create_task(refresh_common_terms())
     print("✅ Database initialized.")
 
 
+async def close_db():
+    """Flush queued memory rows and close the connections."""
+    global db_writer, db_reader, db_recall, memory_writer_task
+    db_maintenance.cancel()
+    if memory_writer_task:
+        await memory_queue.put(None)
+        await memory_writer_task
+        memory_writer_task = None
+    for db in (db_recall, db_reader, db_writer):
+        if db:
+            await db.close()
+    db_writer = db_reader = db_recall = None
+
+
+async def _memory_writer():
+    """Group-commit queued memory rows: every DB_BATCH_SIZE rows or DB_FLUSH_MS, whichever comes first."""
+    loop = asyncio.get_running_loop()
+    stopping = False
+    while not stopping:
+        row = await memory_queue.get()
+        if row is None:
+            break
+        batch = [row]
+        deadline = loop.time() + DB_FLUSH_MS / 1000
+        while len(batch) < DB_BATCH_SIZE:
+            try:
+                row = await asyncio.wait_for(memory_queue.get(), deadline - loop.time())
+            except asyncio.TimeoutError:
+                break
+            if row is None:
+                stopping = True
+                break
+            batch.append(row)
+        try:
+            with metrics.timer("db", "memory_batch"):
+                async with db_write_lock:
+                    await db_writer.executemany(
+                        "INSERT INTO memory (user_id, channel_id, content) VALUES (?, ?, ?)", batch
+                    )
+                    await db_writer.commit()
+            metrics.inc("memory_rows", "", len(batch))
+        except Exception as e:
+            print(f"❌ Failed to write {len(batch)} memory row(s): {e}")
+
+
 async def save_memory(user_id: int, channel_id: int, content: str):
-    async with aiosqlite.connect(DB_FILE) as db:
-        await db.execute(
-            "INSERT INTO memory (user_id, channel_id, content) VALUES (?, ?, ?)",
-            (user_id, channel_id, content),
-        )
-        await db.commit()
+    memory_queue.put_nowait((user_id, channel_id, content))
 
 
-async def get_pref(user_id: int):
-    async with aiosqlite.connect(DB_FILE) as db:
-        async with db.execute(
-            "SELECT preferred_title FROM user_prefs WHERE user_id=?", (user_id,)
-        ) as cursor:
-            row = await cursor.fetchone()
-            return row[0] if row else None
+def _recall_over_budget() -> int:
+    # Runs on the recall connection's thread; a non-zero return aborts the running query.
+    return 1 if _recall_deadline and time.perf_counter() > _recall_deadline else 0
+
+
+async def refresh_common_terms():
+    """
+    Reload the terms recall skips. Scans the whole vocabulary, so it gets its own connection
+    rather than holding up the recall connection or the shared reader for seconds.
+    """
+    global recall_common_terms
+    try:
+        db = await _connect_db()
+        try:
+            async with db.execute(
+                COMMON_TERMS_SQL, (RECALL_COMMON_MIN_ROWS, RECALL_COMMON_FRACTION)
+            ) as cursor:
+                recall_common_terms = frozenset(row[0] for row in await cursor.fetchall())
+        finally:
+            await db.close()
+    except Exception as e:
+        print(f"❌ Failed to load common recall terms: {e}")
+
+
+def recall_terms(text: str) -> list:
+    terms = []
+    for word in _WORD_RE.findall(text.lower()):
+        if word not in RECALL_STOPWORDS and word not in recall_common_terms and word not in terms:
+            terms.append(word)
+            if len(terms) == RECALL_MAX_TERMS:
+                break
+    return terms
+
+
+def recall_query(user_id: int, channel_id: int, terms: list) -> str:
+    """FTS5 query for past lines by this user in this channel containing any of `terms`."""
+    any_term = " OR ".join(f'"{term}"' for term in terms)
+    return f'scope : "u{user_id}c{channel_id}" AND content : ({any_term})'
+
 
+def rank_recalled(terms: list, candidates: list, limit: int) -> list:
+    """Order candidates (newest first) by the number of distinct terms they share; ties keep recency."""
+    wanted = set(terms)
+    scored = [
+        (-len(wanted.intersection(_WORD_RE.findall(content.lower()))), i, content)
+        for i, content in enumerate(candidates)
+    ]
+    scored.sort()
+    return [content for _, _, content in scored[:limit]]
+
+
+@timed("db")
+async def recall_memory(user_id: int, channel_id: int, text: str, limit: int = RECALL_TOP_K) -> list:
+    """Most relevant past lines for this user and channel, or [] if the query misses RECALL_BUDGET_MS."""
+    global _recall_deadline
+    terms = recall_terms(text)
+    if not terms:
+        return []
+    params = {
+        "query": recall_query(user_id, channel_id, terms),
+        "user_id": user_id,
+        "channel_id": channel_id,
+        "limit": RECALL_CANDIDATES,
+    }
+    async with recall_lock:
+        _recall_deadline = time.perf_counter() + RECALL_BUDGET_MS / 1000
+        try:
+            async with db_recall.execute(RECALL_SQL, params) as cursor:
+                rows = await cursor.fetchall()
+        except sqlite3.OperationalError:
+            return []
+        finally:
+            _recall_deadline = 0.0
+    return rank_recalled(terms, [row[0] for row in rows], limit)
 
+
+@timed("db")
+async def get_pref(user_id: int):
+    title = pref_cache.get(user_id)
+    if title is not _MISSING:
+        return title
+    async with db_reader.execute(
+        "SELECT preferred_title FROM user_prefs WHERE user_id=?", (user_id,)
+    ) as cursor:
+        row = await cursor.fetchone()
+    title = row[0] if row else None
+    pref_cache.set(user_id, title)
+    return title
+
+
+@timed("db")
 async def set_pref(user_id: int, title: str):
-    async with aiosqlite.connect(DB_FILE) as db:
-        await db.execute(
-            "INSERT OR REPLACE INTO user_prefs (user_id, preferred_title) VALUES (?, ?)",
-            (user_id, title),
-        )
-        await db.commit()
+    async with db_write_lock:
+        try:
+            await db_writer.execute(
+                "INSERT OR REPLACE INTO user_prefs (user_id, preferred_title) VALUES (?, ?)",
+                (user_id, title),
+            )
+            await db_writer.commit()
+        except Exception:
+            pref_cache.invalidate(user_id)
+            raise
+    pref_cache.set(user_id, title)
+
+
+@timed("db")
+async def get_setting(key: str):
+    value = settings_cache.get(key)
+    if value is not _MISSING:
+        return value
+    async with db_reader.execute("SELECT value FROM settings WHERE key=?", (key,)) as cursor:
+        row = await cursor.fetchone()
+    value = row[0] if row else None
+    settings_cache.set(key, value)
+    return value
+
+
+@timed("db")
+async def set_setting(key: str, value: str):
+    async with db_write_lock:
+        try:
+            await db_writer.execute(
+                "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, value)
+            )
+            await db_writer.commit()
+        except Exception:
+            settings_cache.invalidate(key)
+            raise
+    settings_cache.set(key, value)
 
 
 async def set_primary_guild(guild_id: int):
-    async with aiosqlite.connect(DB_FILE) as db:
-        await db.execute(
-            "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
-            ("primary_guild", str(guild_id))
-        )
-        await db.commit()
+    await set_setting("primary_guild", str(guild_id))
 
 
 async def get_primary_guild():
-    async with aiosqlite.connect(DB_FILE) as db:
-        async with db.execute("SELECT value FROM settings WHERE key=?", ("primary_guild",)) as cursor:
-            row = await cursor.fetchone()
-            return int(row[0]) if row else None
+    value = await get_setting("primary_guild")
+    return int(value) if value else None
+
+
+@timed("db")
+async def save_lockdown_snapshot(rows: list):
+    """Store (guild_id, channel_id, kind, existed, allow, deny) rows, keeping any already saved:
+    a second lockdown must not overwrite the pre-lockdown state with the locked one."""
+    async with db_write_lock:
+        await db_writer.executemany(
+            "INSERT OR IGNORE INTO lockdown_snapshot (guild_id, channel_id, kind, existed, allow, deny) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        await db_writer.commit()
+
+
+@timed("db")
+async def get_lockdown_snapshot(guild_id: int) -> list:
+    async with db_reader.execute(
+        "SELECT channel_id, kind, existed, allow, deny FROM lockdown_snapshot WHERE guild_id=?", (guild_id,)
+    ) as cursor:
+        return await cursor.fetchall()
+
+
+@timed("db")
+async def clear_lockdown_snapshot(guild_id: int, channel_ids: list):
+    async with db_write_lock:
+        await db_writer.executemany(
+            "DELETE FROM lockdown_snapshot WHERE guild_id=? AND channel_id=?",
+            [(guild_id, channel_id) for channel_id in channel_ids],
+        )
+        await db_writer.commit()
+
+
+@timed("db")
+async def record_case(guild_id: int, action: str, target, moderator, reason: str) -> int:
+    async with db_write_lock:
+        cursor = await db_writer.execute(
+            "INSERT INTO mod_cases (guild_id, action, target_id, target, moderator_id, reason) VALUES (?, ?, ?, ?, ?, ?)",
+            (guild_id, action, target.id, str(target), moderator.id, reason),
+        )
+        await db_writer.commit()
+        return cursor.lastrowid
+
+
+@timed("db")
+async def get_cases(guild_id: int, target_id: int = None, limit: int = 10) -> list:
+    """Newest cases in a guild, optionally only those against `target_id`."""
+    sql = "SELECT case_id, action, target, moderator_id, reason, timestamp FROM mod_cases WHERE guild_id=?"
+    params = [guild_id]
+    if target_id is not None:
+        sql += " AND target_id=?"
+        params.append(target_id)
+    sql += " ORDER BY case_id DESC LIMIT ?"
+    params.append(limit)
+    async with db_reader.execute(sql, params) as cursor:
+        return await cursor.fetchall()
+
+
+@timed("db")
+async def save_cached_response(guild_id: int, text: str, reply: str, expires: float):
+    async with db_write_lock:
+        await db_writer.execute(
+            "INSERT OR REPLACE INTO response_cache (guild_id, text, reply, expires) VALUES (?, ?, ?, ?)",
+            (guild_id, text, reply, expires),
+        )
+        await db_writer.commit()
+
+
+@timed("db")
+async def load_cached_responses(limit: int) -> list:
+    """Unexpired cached replies as (guild_id, text, reply, expires), oldest first."""
+    async with db_reader.execute(
+        "SELECT guild_id, text, reply, expires FROM response_cache WHERE expires > ? ORDER BY expires DESC LIMIT ?",
+        (time.time(), limit),
+    ) as cursor:
+        rows = await cursor.fetchall()
+    return rows[::-1]
+
+
+@timed("db")
+async def clear_cached_responses(guild_id: int = None):
+    """Forget cached replies for one guild, or expired ones everywhere when guild_id is None."""
+    async with db_write_lock:
+        if guild_id is None:
+            await db_writer.execute("DELETE FROM response_cache WHERE expires <= ?", (time.time(),))
+        else:
+            await db_writer.execute("DELETE FROM response_cache WHERE guild_id = ?", (guild_id,))
+        await db_writer.commit()
+
+
+@timed("db")
+async def outbox_put(guild_id: int, channel_id: int, embeds: list):
+    async with db_write_lock:
+        await db_writer.executemany(
+            "INSERT INTO log_outbox (guild_id, channel_id, embed) VALUES (?, ?, ?)",
+            [(guild_id, channel_id, json.dumps(embed.to_dict())) for embed in embeds],
+        )
+        await db_writer.commit()
+
+
+@timed("db")
+async def outbox_take(limit: int) -> list:
+    """Oldest queued log embeds for guilds on this process's shards, as (id, channel_id, Embed)."""
+    # memory.db is shared by every cluster; a guild's shard is (guild_id >> 22) % SHARD_COUNT.
+    owned, params = "", ()
+    if SHARD_COUNT and SHARD_IDS is not None:
+        owned = f"WHERE (guild_id >> 22) % ? IN ({', '.join('?' * len(SHARD_IDS))})"
+        params = (SHARD_COUNT, *SHARD_IDS)
+    async with db_reader.execute(
+        f"SELECT id, channel_id, embed FROM log_outbox {owned} ORDER BY id LIMIT ?", (*params, limit)
+    ) as cursor:
+        rows = await cursor.fetchall()
+    return [(row_id, channel_id, discord.Embed.from_dict(json.loads(embed))) for row_id, channel_id, embed in rows]
+
+
+@timed("db")
+async def outbox_delete(ids: list):
+    async with db_write_lock:
+        await db_writer.executemany("DELETE FROM log_outbox WHERE id=?", [(row_id,) for row_id in ids])
+        await db_writer.commit()
+
+
+@timed("db")
+async def archive_old_memory() -> int:
+    """
+    Move memory rows older than MEMORY_RETENTION_DAYS into ARCHIVE_FILE as compressed
+    per-channel, per-month chunks. Works in id order a batch at a time, stopping at the first
+    batch with nothing old in it, and releases the write lock between batches so the memory
+    writer isn't starved.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(days=MEMORY_RETENTION_DAYS)
+    cutoff = cutoff.strftime("%Y-%m-%d %H:%M:%S")
+    archived = 0
+    after = 0
+    while True:
+        async with db_write_lock:
+            async with db_writer.execute(
+                "SELECT id, user_id, channel_id, timestamp, content FROM memory WHERE id > ? ORDER BY id LIMIT ?",
+                (after, ARCHIVE_BATCH),
+            ) as cursor:
+                rows = await cursor.fetchall()
+            # Ids mostly follow insertion time, so old rows sit near the start of the table, but a clock
+            # step or an imported snapshot can interleave newer ones: only rows archived here are deleted.
+            old = [row for row in rows if row[3] < cutoff]
+            if not old:
+                return archived
+            chunks = {}
+            for row in old:
+                chunks.setdefault((row[2], row[3][:7]), []).append(row)
+            await db_writer.executemany(
+                "INSERT INTO archive.memory_archive (channel_id, month, first_id, last_id, row_count, payload) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (channel_id, month, chunk[0][0], chunk[-1][0], len(chunk), zlib.compress(json.dumps(chunk).encode()))
+                    for (channel_id, month), chunk in chunks.items()
+                ],
+            )
+            await db_writer.executemany("DELETE FROM memory WHERE id = ?", [(row[0],) for row in old])
+            await db_writer.commit()
+        archived += len(old)
+        if len(rows) < ARCHIVE_BATCH:
+            return archived
+        after = rows[-1][0]
+        await asyncio.sleep(0)
+
+
+def _backup_to(path: str):
+    source = sqlite3.connect(DB_FILE)
+    target = sqlite3.connect(path)
+    try:
+        source.backup(target, pages=1024)
+    finally:
+        target.close()
+        source.close()
+
+
+@timed("db")
+async def backup_db() -> str:
+    """Take an online snapshot of DB_FILE into BACKUP_DIR, keeping the newest BACKUP_KEEP."""
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(BACKUP_DIR, f"memory-{stamp}.db")
+    # The backup API copies a consistent snapshot while the bot keeps writing; run it off the loop.
+    await asyncio.to_thread(_backup_to, path + ".tmp")
+    os.replace(path + ".tmp", path)
+    snapshots = sorted(name for name in os.listdir(BACKUP_DIR) if name.endswith(".db"))
+    for name in snapshots[:-BACKUP_KEEP]:
+        os.remove(os.path.join(BACKUP_DIR, name))
+    return path
+
+
+@tasks.loop(hours=MAINTENANCE_HOURS)
+async def db_maintenance():
+    """Archive old memory, compact the hot DB, checkpoint the WAL, then snapshot it."""
+    started = time.perf_counter()
+    try:
+        archived = await archive_old_memory()
+        await clear_cached_responses()
+        async with db_write_lock:
+            await db_writer.execute(f"PRAGMA incremental_vacuum({VACUUM_PAGES})")
+            # Merge FTS segments a little at a time; fewer segments keep recall seeks cheap.
+            await db_writer.execute("INSERT INTO memory_fts (memory_fts, rank) VALUES ('merge', 500)")
+            await db_writer.commit()
+            await db_writer.execute("PRAGMA optimize")
+            await db_writer.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        await refresh_common_terms()
+        snapshot = await backup_db()
+        print(f"🧹 DB maintenance: archived {archived} row(s), snapshot {snapshot} ({time.perf_counter() - started:.1f}s)")
+    except Exception as e:
+        print(f"❌ DB maintenance failed: {e}")
+
+
+# =======================
+# PROMPTS
+# =======================
+# Personas are fixed strings and always sent first, so every request shares a cacheable prefix.
+JARVIS_PERSONA = (
+    "You are J.A.R.V.I.S., Tony Stark's artificial intelligence from the Marvel universe. "
+    "You are calm, articulate, and capable of dry sarcasm. You think logically and use context. "
+    "You serve only your creator (the OWNER_ID user). For everyone else, you may help if appropriate, "
+    "but you are not subservient. Avoid unnecessary politeness. Respond naturally and concisely, "
+    "as if you truly understand human behavior. Use common sense, realistic tone, and occasional wit."
+)
+AUTO_PERSONA = "You are J.A.R.V.I.S., Tony Stark's AI assistant. Step in only when context is important or technical."
+
+tokenizer = None  # tiktoken encoding once load_tokenizer has run, if tiktoken is available
+
+
+def load_tokenizer():
+    """Load the model's encoding. It may download on first use, so call it off the event loop."""
+    global tokenizer
+    if tiktoken is None:
+        return
+    try:
+        try:
+            tokenizer = tiktoken.encoding_for_model(OPENAI_MODEL)
+        except KeyError:
+            tokenizer = tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        print(f"⚠️ Tokenizer unavailable, estimating tokens: {e}")
+
+
+def count_tokens(text: str) -> int:
+    if tokenizer is not None:
+        return len(tokenizer.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def truncate_tokens(text: str, limit: int) -> str:
+    """`text` cut to about `limit` tokens, keeping the head and tail (where errors and stack tops tend to be)."""
+    if count_tokens(text) <= limit:
+        return text
+    keep = max(limit - 8, 2)  # room for the marker
+    if tokenizer is not None:
+        tokens = tokenizer.encode(text, disallowed_special=())
+        head, tail = tokenizer.decode(tokens[:keep // 2]), tokenizer.decode(tokens[-(keep - keep // 2):])
+        cut = len(tokens) - keep
+    else:
+        head, tail = text[:keep // 2 * 4], text[-(keep - keep // 2) * 4:]
+        cut = count_tokens(text) - keep
+    return f"{head} […{cut} tokens cut…] {tail}"
+
+
+def _fit_lines(lines: list, budget: int, newest_first: bool = True):
+    """Truncate each line and keep as many as fit `budget`, preferring the newest. Returns (kept, omitted)."""
+    kept = []
+    for line in (reversed(lines) if newest_first else lines):
+        line = truncate_tokens(line, PROMPT_LINE_TOKENS)
+        cost = count_tokens(line) + 1
+        if cost > budget:
+            break
+        budget -= cost
+        kept.append(line)
+    if newest_first:
+        kept.reverse()
+    return kept, len(lines) - len(kept)
+
+
+def build_prompt(author: str, content: str, history: list = (), recalled: list = (), persona: str = JARVIS_PERSONA) -> str:
+    """
+    The user turn for a request: recalled memory, channel history, then the message being answered.
+    Everything is trimmed to fit PROMPT_TOKEN_BUDGET alongside `persona`.
+    """
+    history = list(history)
+    if history and f"{author}: {content}".startswith(history[-1]):
+        history.pop()  # the message being answered is already in the channel context
+    message_line = f"User: {author} said: {truncate_tokens(content, PROMPT_MESSAGE_TOKENS)}"
+    budget = PROMPT_TOKEN_BUDGET - count_tokens(persona) - count_tokens(message_line) - 32
+
+    parts = []
+    if recalled and budget > 0:
+        memory, _ = _fit_lines(recalled, int(budget * PROMPT_RECALL_SHARE), newest_first=False)
+        if memory:
+            memory_text = "\n".join(f"- {past}" for past in memory)
+            parts.append(f"Relevant earlier messages from this user:\n{memory_text}")
+            budget -= count_tokens(parts[-1])
+    if history:
+        kept, omitted = _fit_lines(history, max(budget, 0))
+        if omitted:
+            kept.insert(0, f"[{omitted} earlier message{'s' if omitted != 1 else ''} omitted]")
+        parts.append("Context:\n" + "\n".join(kept))
+    parts.append(message_line)
+    return "\n\n".join(parts)
+
+
+def log_tokens(estimated: int, usage):
+    """Record one request's token use; `usage` is the API's usage object, when it sent one."""
+    metrics.inc("ai_tokens", "estimated", estimated)
+    if usage is None:
+        print(f"🧮 AI request: ~{estimated} input tokens")
+        return
+    details = getattr(usage, "input_tokens_details", None)
+    cached = getattr(details, "cached_tokens", 0) or 0
+    metrics.inc("ai_tokens", "input", usage.input_tokens)
+    metrics.inc("ai_tokens", "cached", cached)
+    metrics.inc("ai_tokens", "output", usage.output_tokens)
+    print(f"🧮 AI request: {usage.input_tokens} in ({cached} cached, ~{estimated} est), {usage.output_tokens} out")
 
 
 # =======================
 # AI
 # =======================
-async def ai_reply(system_prompt: str, user_prompt: str) -> str:
+def _guild_slot(guild_id):
+    if guild_id is None:
+        return contextlib.nullcontext()
+    slot = ai_guild_slots.get(guild_id)
+    if slot is None:
+        slot = ai_guild_slots[guild_id] = asyncio.Semaphore(AI_GUILD_CONCURRENCY)
+    return slot
+
+
+def _backoff_delay(attempt: int, error: Exception) -> float:
+    """Full-jitter exponential backoff, honouring Retry-After when the API sends one."""
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), AI_BACKOFF_MAX)
+        except ValueError:
+            pass
+    return random.uniform(0, min(AI_BACKOFF_MAX, AI_BACKOFF_BASE * 2 ** attempt))
+
+
+def _ai_input(system_prompt: str, user_prompt: str) -> list:
+    # The system prompt leads so requests sharing a persona share a cached prefix.
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
+
+
+def _cache_key(system_prompt: str) -> str:
+    """Route requests with the same persona together so the provider can reuse its prompt cache."""
+    return "jarvis-" + hashlib.sha1(system_prompt.encode()).hexdigest()[:12]
+
+
+async def ai_reply(system_prompt: str, user_prompt: str, guild_id: int = None) -> str:
     if not oai:
         return "⚠️ OpenAI not configured."
-    try:
-        resp = oai.responses.create(
-            model=OPENAI_MODEL,
-            input=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-        )
-        for item in resp.output:
-            if item.type == "message":
-                return "".join(
-                    [part.text for part in item.content if getattr(part, "type", "") == "output_text"]
+    for attempt in range(AI_MAX_RETRIES + 1):
+        requested = time.perf_counter()
+        try:
+            async with _guild_slot(guild_id), ai_slots:
+                sent = time.perf_counter()
+                metrics.observe("ai", "slot_wait", sent - requested)
+                resp = await oai.responses.create(
+                    model=OPENAI_MODEL,
+                    input=_ai_input(system_prompt, user_prompt),
+                    prompt_cache_key=_cache_key(system_prompt),
                 )
-        return "✅ Done."
-    except Exception as e:
-        return f"❌ AI error: {e}"
+                metrics.observe("ai", "reply", time.perf_counter() - sent)
+            log_tokens(count_tokens(system_prompt) + count_tokens(user_prompt), resp.usage)
+            for item in resp.output:
+                if item.type == "message":
+                    return "".join(
+                        [part.text for part in item.content if getattr(part, "type", "") == "output_text"]
+                    )
+            return "✅ Done."
+        except (RateLimitError, InternalServerError, APITimeoutError, APIConnectionError) as e:
+            metrics.inc("ai_errors", type(e).__name__)
+            if attempt == AI_MAX_RETRIES:
+                return f"❌ AI error: {e}"
+            # Sleep outside the slots so a backing-off request doesn't hold capacity.
+            await asyncio.sleep(_backoff_delay(attempt, e))
+        except Exception as e:
+            metrics.inc("ai_errors", type(e).__name__)
+            return f"❌ AI error: {e}"
+
+
+async def ai_stream(system_prompt: str, user_prompt: str, guild_id: int = None):
+    """Yield reply text as it is generated. Errors are yielded as text, like ai_reply returns them."""
+    if not oai:
+        yield "⚠️ OpenAI not configured."
+        return
+    for attempt in range(AI_MAX_RETRIES + 1):
+        started = False
+        requested = time.perf_counter()
+        try:
+            async with _guild_slot(guild_id), ai_slots:
+                sent = time.perf_counter()
+                metrics.observe("ai", "slot_wait", sent - requested)
+                stream = await oai.responses.create(
+                    model=OPENAI_MODEL,
+                    input=_ai_input(system_prompt, user_prompt),
+                    prompt_cache_key=_cache_key(system_prompt),
+                    stream=True,
+                )
+                async for event in stream:
+                    if event.type == "response.output_text.delta":
+                        if not started:
+                            started = True
+                            metrics.observe("ai", "first_token", time.perf_counter() - sent)
+                        yield event.delta
+                    elif event.type == "response.completed":
+                        metrics.observe("ai", "stream", time.perf_counter() - sent)
+                        log_tokens(count_tokens(system_prompt) + count_tokens(user_prompt), event.response.usage)
+            return
+        except (RateLimitError, InternalServerError, APITimeoutError, APIConnectionError) as e:
+            metrics.inc("ai_errors", type(e).__name__)
+            # Once text is on screen a retry would repeat it, so only retry before the first chunk.
+            if started or attempt == AI_MAX_RETRIES:
+                yield f"\n❌ AI error: {e}" if started else f"❌ AI error: {e}"
+                return
+            await asyncio.sleep(_backoff_delay(attempt, e))
+        except Exception as e:
+            metrics.inc("ai_errors", type(e).__name__)
+            yield f"\n❌ AI error: {e}" if started else f"❌ AI error: {e}"
+            return
+
+
+async def ai_chunks(system_prompt: str, user_prompt: str, guild_id: int = None):
+    """Reply text in chunks: streamed when AI_STREAMING is on, otherwise one chunk from ai_reply."""
+    if AI_STREAMING:
+        async for chunk in ai_stream(system_prompt, user_prompt, guild_id):
+            yield chunk
+    else:
+        yield await ai_reply(system_prompt, user_prompt, guild_id)
 
 
 # =======================
@@ -162,6 +1286,18 @@ def is_owner(user: discord.abc.User) -> bool:
     return user.id == OWNER_ID
 
 
+def account_risk(created_at):
+    """Account age in days and a short risk note for join logs and database checks."""
+    account_age_days = (discord.utils.utcnow() - created_at).days
+    if account_age_days < 1:
+        risk_note = "High Risk: Account less than 24h old!"
+    elif account_age_days < 7:
+        risk_note = "Possible Alt: Account less than 7 days old."
+    else:
+        risk_note = "Looks safe."
+    return account_age_days, risk_note
+
+
 def sanitize_reply(text: str) -> str:
     """Prevent Jarvis from pinging users or everyone."""
     return (
@@ -171,86 +1307,1434 @@ def sanitize_reply(text: str) -> str:
     )
 
 
-async def log_mod_action(guild, action, target, reason, moderator):
+_BLOCKED_TOKENS = ("@everyone", "@here", "<@")
+
+
+def _sanitize_chunk(text: str):
+    """Sanitize streamed text, holding back a tail that could be the start of a blocked token."""
+    for i in range(max(0, len(text) - len("@everyone") + 1), len(text)):
+        tail = text[i:]
+        if any(token.startswith(tail) for token in _BLOCKED_TOKENS):
+            return sanitize_reply(text[:i]), tail
+    return sanitize_reply(text), ""
+
+
+def _page_break(text: str, start: int) -> int:
+    """Where to end a page that starts at `start`: the last newline/space within the limit if there is one."""
+    end = start + MESSAGE_LIMIT
+    for sep in ("\n", " "):
+        cut = text.rfind(sep, start + MESSAGE_LIMIT // 2, end)
+        if cut != -1:
+            return cut + 1
+    return end
+
+
+async def text_chunks(text: str):
+    """A finished reply as a chunk source for stream_reply."""
+    yield text
+
+
+async def stream_reply(message: discord.Message, chunks, prefix: str = "", mention_author: bool = False) -> str:
+    """
+    Reply to `message` with text from `chunks`, posting as soon as the first chunk arrives
+    and editing in place at most every STREAM_EDIT_INTERVAL seconds. Text past MESSAGE_LIMIT
+    continues in follow-up messages. Returns the full sanitized reply.
+    """
+    text = prefix      # sanitized reply so far
+    held = ""          # raw tail not yet safe to show
+    page_start = 0     # offset in `text` where the current Discord message begins
+    current = None     # Discord message showing text[page_start:]
+    shown = ""
+    last_edit = 0.0
+
+    async def send_page(page):
+        with metrics.timer("rest", "send"):
+            if page_start == 0:
+                return await message.reply(page, mention_author=mention_author)
+            return await message.channel.send(page)
+
+    async def edit(page):
+        with metrics.timer("rest", "edit"):
+            await current.edit(content=page)
+
+    async def publish(final: bool):
+        nonlocal page_start, current, shown, last_edit
+        while len(text) - page_start > MESSAGE_LIMIT:
+            cut = _page_break(text, page_start)
+            page = text[page_start:cut]
+            if current is None:
+                await send_page(page)
+            elif page != shown:
+                await edit(page)
+            current, shown, page_start = None, "", cut
+        page = text[page_start:]
+        if not page.strip():
+            return
+        if current is None:
+            current = await send_page(page)
+        elif page != shown and (final or time.monotonic() - last_edit >= STREAM_EDIT_INTERVAL):
+            await edit(page)
+        else:
+            return
+        shown, last_edit = page, time.monotonic()
+
+    async for chunk in chunks:
+        safe, held = _sanitize_chunk(held + chunk)
+        text += safe
+        await publish(final=False)
+    text += sanitize_reply(held)
+    if text == prefix:
+        text += "✅ Done."
+    await publish(final=True)
+    return text
+
+
+# =======================
+# MOD LOG
+# =======================
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "2"))  # seconds an embed may wait to be batched
+LOG_SEND_TIMEOUT = 10.0    # a send slower than this is treated as rate limited and spilled to the outbox
+LOG_BUFFER_LIMIT = 100     # embeds buffered per channel before, while sends are backed up, they go to the outbox
+EMBEDS_PER_MESSAGE = 10    # Discord limits
+EMBED_CHARS_PER_MESSAGE = 6000
+EMBED_FIELD_CHARS = 1024
+
+
+def pack_embeds(embeds: list) -> list:
+    """Split embeds into messages of at most 10 embeds and 6000 characters each."""
+    batches, batch, size = [], [], 0
+    for embed in embeds:
+        length = len(embed)
+        if batch and (len(batch) == EMBEDS_PER_MESSAGE or size + length > EMBED_CHARS_PER_MESSAGE):
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append(embed)
+        size += length
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class LogSink:
+    """
+    Buffers log embeds per channel and sends them packed into as few messages as possible,
+    when a channel has a full message's worth or every LOG_FLUSH_INTERVAL seconds. Anything
+    that can't be sent promptly goes to the SQLite outbox, and the whole outbox is sent before
+    any newer embed. Buffers only spill there under backpressure, not just because a burst is big.
+    Only temporary failures (timeouts, 429s, 5xx) are retried; a batch Discord rejects outright
+    is logged and dropped so it can't hold up everything queued behind it.
+    """
+
+    def __init__(self):
+        self._buffers = {}  # channel_id -> (channel, [Embed])
+        self._wake = asyncio.Event()
+        self._task = None
+        self._flush_started = None  # monotonic time the running flush began
+        self._failing = False       # the last send failed temporarily
+        self.sent_messages = 0
+        self.spilled = 0
+        self.dropped = 0
+
+    def post(self, channel, embed: discord.Embed):
+        _, buffer = self._buffers.setdefault(channel.id, (channel, []))
+        buffer.append(embed)
+        if len(buffer) >= LOG_BUFFER_LIMIT and self.backed_up():
+            # Sends are falling behind; park the backlog in the outbox instead of memory.
+            del self._buffers[channel.id]
+            spawn(self._spill(channel, buffer))
+        elif len(buffer) >= EMBEDS_PER_MESSAGE:
+            self._wake.set()
+
+    def backed_up(self) -> bool:
+        """Sends are failing, or a flush has been running longer than the flush interval."""
+        if self._failing:
+            return True
+        return self._flush_started is not None and time.monotonic() - self._flush_started > LOG_FLUSH_INTERVAL
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Stop flushing and park whatever is still buffered in the outbox for the next run."""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        buffers, self._buffers = self._buffers, {}
+        for channel, embeds in buffers.values():
+            await self._spill(channel, embeds)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), LOG_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"❌ Log flush failed: {e}")
+
+    async def flush(self):
+        self._flush_started = time.monotonic()
+        try:
+            if not await self._drain_outbox():
+                return
+            buffers, self._buffers = self._buffers, {}
+            for channel, embeds in buffers.values():
+                await self._send(channel, embeds)
+        finally:
+            self._flush_started = None
+
+    async def _drain_outbox(self) -> bool:
+        """Send every queued outbox embed; False if they couldn't all go out, so newer ones wait behind them."""
+        while True:
+            rows = await outbox_take(EMBEDS_PER_MESSAGE * 5)
+            if not rows:
+                return True
+            by_channel = {}
+            for row_id, channel_id, embed in rows:
+                by_channel.setdefault(channel_id, []).append((row_id, embed))
+            for channel_id, items in by_channel.items():
+                channel = bot.get_channel(channel_id)
+                if channel is None:
+                    if not bot.is_ready():
+                        return False  # the channel cache is still filling; try again once it has
+                    # The row is for one of our guilds and the cache is complete, so the channel is gone.
+                    await outbox_delete([row_id for row_id, _ in items])
+                    continue
+                for batch in pack_embeds([embed for _, embed in items]):
+                    ids = [row_id for row_id, _ in items[:len(batch)]]
+                    items = items[len(batch):]
+                    if not await self._send_batch(channel, batch):
+                        return False
+                    await outbox_delete(ids)
+
+    async def _send(self, channel, embeds: list):
+        batches = pack_embeds(embeds)
+        for i, batch in enumerate(batches):
+            if not await self._send_batch(channel, batch):
+                await self._spill(channel, [embed for rest in batches[i:] for embed in rest])
+                return
+
+    async def _send_batch(self, channel, batch: list) -> bool:
+        """True once the batch is dealt with (sent, or dropped as undeliverable); False to retry it later."""
+        try:
+            with metrics.timer("rest", "log_send"):
+                await asyncio.wait_for(channel.send(embeds=batch), LOG_SEND_TIMEOUT)
+        except asyncio.TimeoutError:
+            self._failing = True
+            return False
+        except discord.HTTPException as e:
+            if e.status == 429 or e.status >= 500:
+                self._failing = True
+                return False
+            self._failing = False
+            self.dropped += len(batch)
+            print(f"❌ Dropped {len(batch)} log embeds for #{getattr(channel, 'name', channel.id)}: {e}")
+            return True
+        self._failing = False
+        self.sent_messages += 1
+        return True
+
+    async def _spill(self, channel, embeds: list):
+        await outbox_put(channel.guild.id, channel.id, embeds)
+        self.spilled += len(embeds)
+
+
+log_sink = LogSink()
+
+
+async def log_mod_action(guild, action, target, reason, moderator) -> int:
+    """Record a case and queue its mod-log embed. Returns the case number."""
+    case_id = await record_case(guild.id, action, target, moderator, reason)
     log_channel = guild.get_channel(MOD_LOG_CHANNEL_ID)
     if not log_channel:
-        return
-    embed = discord.Embed(title=f"{action}", color=discord.Color.red())
+        return case_id
+    embed = discord.Embed(title=f"{action} | Case #{case_id}", color=discord.Color.red())
     embed.add_field(name="Target", value=f"{target} (`{target.id}`)", inline=False)
-    embed.add_field(name="Reason", value=reason, inline=False)
+    embed.add_field(name="Reason", value=reason[:EMBED_FIELD_CHARS], inline=False)
     embed.add_field(name="Moderator", value=f"{moderator} (`{moderator.id}`)", inline=False)
     embed.timestamp = discord.utils.utcnow()
-    await log_channel.send(embed=embed)
+    log_sink.post(log_channel, embed)
+    return case_id
 
 
 # =======================
-# EVENTS
+# CHANNEL CONTEXT
 # =======================
-@bot.event
-async def on_ready():
-    statuses = [
-        # Playing Status
-        discord.Activity(
-            type=discord.ActivityType.playing,
-            name="<:your_emoji_here:000000000000000000> Grant Development."
-        ),
+class ChannelContext:
+    """
+    The last few non-bot messages of each channel, filled from gateway events so replies
+    don't need a channel.history() call. Channels are kept in LRU order; idle ones and
+    those past max_channels are evicted, which caps memory at max_channels * size messages.
+    """
+
+    def __init__(self, size: int, max_channels: int, idle_ttl: float):
+        self.size = size
+        self.max_channels = max_channels
+        self.idle_ttl = idle_ttl
+        self.rest_fetches = 0
+        # channel_id -> [last_seen, warm, deque of [message_id, author_name, content]]
+        self._channels = OrderedDict()
+
+    def _entry(self, channel_id: int):
+        entry = self._channels.get(channel_id)
+        if entry is None:
+            # A channel we haven't seen is cold: its buffer misses whatever came before now.
+            entry = self._channels[channel_id] = [0.0, False, deque(maxlen=self.size)]
+        entry[0] = time.monotonic()
+        self._channels.move_to_end(channel_id)
+        self._evict()
+        return entry
+
+    def _evict(self):
+        cutoff = time.monotonic() - self.idle_ttl
+        while self._channels:
+            channel_id, entry = next(iter(self._channels.items()))
+            if len(self._channels) <= self.max_channels and entry[0] >= cutoff:
+                break
+            del self._channels[channel_id]
+
+    def record(self, message: discord.Message):
+        entry = self._entry(message.channel.id)
+        entry[2].append([message.id, message.author.display_name, message.content[:CONTEXT_MAX_CHARS]])
+
+    def edit(self, channel_id: int, message_id: int, content: str):
+        entry = self._channels.get(channel_id)
+        if entry:
+            for item in entry[2]:
+                if item[0] == message_id:
+                    item[2] = content[:CONTEXT_MAX_CHARS]
+                    break
+
+    def delete(self, channel_id: int, message_ids):
+        entry = self._channels.get(channel_id)
+        if entry:
+            kept = [item for item in entry[2] if item[0] not in message_ids]
+            if len(kept) != len(entry[2]):
+                entry[2] = deque(kept, maxlen=self.size)
+
+    async def lines(self, channel) -> list:
+        """Context lines for `channel`, oldest first. Only a cold channel costs a REST fetch."""
+        entry = self._entry(channel.id)
+        if not entry[1]:
+            recent = []
+            with metrics.timer("rest", "history"):
+                async for msg in channel.history(limit=self.size, oldest_first=False):
+                    if not msg.author.bot:
+                        recent.append([msg.id, msg.author.display_name, msg.content[:CONTEXT_MAX_CHARS]])
+            self.rest_fetches += 1
+            entry[1] = True
+            entry[2] = deque(recent[::-1], maxlen=self.size)
+        return [f"{name}: {content}" for _, name, content in entry[2]]
+
+
+channel_context = ChannelContext(CONTEXT_SIZE, CONTEXT_MAX_CHANNELS, CONTEXT_IDLE_TTL)
 
-        # Watching Status
-        discord.Activity(
-            type=discord.ActivityType.watching,
-            name="<:your_emoji_here:000000000000000000> over system logs."
-        ),
 
-        # Listening Status
-        discord.Activity(
-            type=discord.ActivityType.listening,
-            name="<:your_emoji_here:000000000000000000> user feedback."
-        ),
+# =======================
+# MEMBER CACHE
+# =======================
+member_cache = TTLCache(MEMBER_LRU_SIZE, MEMBER_LRU_TTL)  # (guild_id, user_id) -> Member
 
-        # Streaming Status
-        discord.Streaming(
-            name="<:your_emoji_here:000000000000000000> Building Networks.",
-            url="https://twitch.tv/yourchannel"  # must be Twitch/YouTube to show purple tag
-        )
+
+def remember_member(member):
+    if isinstance(member, discord.Member):
+        member_cache.set((member.guild.id, member.id), member)
+
+
+async def resolve_member(guild: discord.Guild, user_id: int):
+    """A guild member from the LRU, the gateway cache or the API, in that order; None if not in the guild."""
+    member = member_cache.get((guild.id, user_id), None) or guild.get_member(user_id)
+    if member is None:
+        try:
+            with metrics.timer("rest", "fetch_member"):
+                member = await guild.fetch_member(user_id)
+        except discord.HTTPException:
+            return None
+    remember_member(member)
+    return member
+
+
+async def command_target(message: discord.Message, args: list):
+    """The member a mod command acts on: the first mention, or a user ID as the first argument."""
+    if message.mentions:
+        remember_member(message.mentions[0])
+        return message.mentions[0]
+    if args and args[0].strip("<@!>").isdigit():
+        return await resolve_member(message.guild, int(args[0].strip("<@!>")))
+    return None
+
+
+# =======================
+# AI QUEUE
+# =======================
+PRIORITY_OWNER = 0
+PRIORITY_CONVERSATION = 1  # mentions and follow-ups
+PRIORITY_AUTO = 2          # keyword auto-responses
+LANE_NAMES = {PRIORITY_OWNER: "owner", PRIORITY_CONVERSATION: "conversation", PRIORITY_AUTO: "auto"}
+
+background_tasks = set()
+
+
+def spawn(coro):
+    """Run `coro` in the background, keeping a reference so the task isn't garbage-collected."""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+class AIQueue:
+    """
+    Reply jobs served by a fixed pool of workers, owner first, then conversations, then
+    auto-responses. Jobs that waited longer than `max_wait` are dropped rather than answered
+    late, and non-owner jobs are shed once `maxsize` are waiting. At most `guild_limit` jobs
+    per guild run at once; a guild's excess jobs are parked until one of its jobs finishes,
+    so a busy guild never ties up workers that other guilds could use.
+    """
+
+    def __init__(self, workers: int, maxsize: int, max_wait: float, guild_limit: int):
+        self.workers = workers
+        self.maxsize = maxsize
+        self.max_wait = max_wait
+        self.guild_limit = guild_limit
+        self._queue = asyncio.PriorityQueue()
+        self._seq = itertools.count()
+        self._running = {}  # guild_id -> jobs running
+        self._parked = {}   # guild_id -> heap of queue entries waiting for that guild's cap
+        self._tasks = []
+        self.depth_by_lane = {lane: 0 for lane in LANE_NAMES}
+        self.completed = 0
+        self.failed = 0
+        self.dropped_full = 0
+        self.dropped_stale = 0
+        self.wait_avg = 0.0  # exponentially weighted, seconds
+        self.wait_max = 0.0
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() + sum(len(parked) for parked in self._parked.values())
+
+    def submit(self, priority: int, job, on_drop=None, guild_id: int = None) -> bool:
+        """Queue `job` (a coroutine function). `on_drop` is called instead if the job is shed."""
+        if priority != PRIORITY_OWNER and self.depth >= self.maxsize:
+            self.dropped_full += 1
+            if on_drop:
+                on_drop()
+            return False
+        self._queue.put_nowait((priority, next(self._seq), time.monotonic(), guild_id, job, on_drop))
+        self.depth_by_lane[priority] += 1
+        return True
+
+    def _release(self, guild_id: int):
+        self._running[guild_id] -= 1
+        if not self._running[guild_id]:
+            del self._running[guild_id]
+        self._unpark(guild_id)
+
+    def _unpark(self, guild_id: int):
+        """Requeue the guild's next parked job, if any; it is re-parked if the guild is still at its cap."""
+        parked = self._parked.get(guild_id)
+        if parked:
+            self._queue.put_nowait(heapq.heappop(parked))
+            if not parked:
+                del self._parked[guild_id]
+
+    async def _worker(self):
+        while True:
+            entry = await self._queue.get()
+            priority, _, queued_at, guild_id, job, on_drop = entry
+            waited = time.monotonic() - queued_at
+            at_cap = guild_id is not None and self._running.get(guild_id, 0) >= self.guild_limit
+            if at_cap and waited <= self.max_wait:
+                heapq.heappush(self._parked.setdefault(guild_id, []), entry)
+                continue
+            self.depth_by_lane[priority] -= 1
+            metrics.observe("ai_queue_wait", LANE_NAMES[priority], waited)
+            self.wait_avg = 0.9 * self.wait_avg + 0.1 * waited
+            self.wait_max = max(self.wait_max, waited)
+            if waited > self.max_wait:
+                self.dropped_stale += 1
+                if on_drop:
+                    on_drop()
+                if guild_id is not None:
+                    # A requeued job was the guild's turn; pass it on or the rest stay parked for good.
+                    self._unpark(guild_id)
+                continue
+            if guild_id is not None:
+                self._running[guild_id] = self._running.get(guild_id, 0) + 1
+            try:
+                with metrics.timer("ai_job", LANE_NAMES[priority]):
+                    await job()
+                self.completed += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"❌ AI job failed: {e}")
+            finally:
+                if guild_id is not None:
+                    self._release(guild_id)
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth,
+            "depth_by_lane": {LANE_NAMES[lane]: n for lane, n in self.depth_by_lane.items()},
+            "completed": self.completed,
+            "failed": self.failed,
+            "dropped_full": self.dropped_full,
+            "dropped_stale": self.dropped_stale,
+            "wait_avg_ms": self.wait_avg * 1000,
+            "wait_max_ms": self.wait_max * 1000,
+        }
+
+
+ai_queue = AIQueue(AI_WORKERS, AI_QUEUE_SIZE, CONVERSATION_WINDOW, AI_GUILD_CONCURRENCY)
+
+
+# =======================
+# SHARED STATE
+# =======================
+STATE_SWEEP_EVERY = 1000  # sets between purges of expired keys
+STATE_MAX_KEYS = 10000    # in-memory keys/buckets kept (LRU)
+
+
+class MemoryState:
+    """Cross-shard state for a single process: expiring keys and token buckets, both LRU-bounded."""
+
+    def __init__(self, max_keys: int = STATE_MAX_KEYS):
+        self.max_keys = max_keys
+        self._values = OrderedDict()   # key -> (value, expires_at or None)
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def get(self, key: str, default=None):
+        entry = self._values.get(key)
+        if entry is None:
+            return default
+        value, expires = entry
+        if expires is not None and expires <= time.time():
+            del self._values[key]
+            return default
+        return value
+
+    async def set(self, key: str, value, ttl: float = None):
+        self._values[key] = (value, time.time() + ttl if ttl else None)
+        self._values.move_to_end(key)
+        while len(self._values) > self.max_keys:
+            self._values.popitem(last=False)
+
+    async def delete(self, key: str):
+        self._values.pop(key, None)
+
+    async def take_tokens(self, buckets) -> bool:
+        """Spend one token from every (key, burst, refill) bucket, or none if any of them is empty."""
+        now = time.time()
+        levels = []
+        for key, burst, refill in buckets:
+            entry = self._buckets.get(key)
+            level = float(burst) if entry is None else min(float(burst), entry[0] + (now - entry[1]) / refill)
+            if level < 1:
+                return False
+            levels.append((key, level - 1))
+        for key, level in levels:
+            self._buckets[key] = (level, now)
+            self._buckets.move_to_end(key)
+        # The least recently used key has been idle longest; dropping it only forgets a (nearly) full bucket.
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return True
+
+
+class SQLiteState:
+    """
+    Cross-shard state shared by every cluster on the host through one WAL-mode SQLite file.
+    Values are JSON; bucket updates run in a BEGIN IMMEDIATE transaction so processes can't double-spend.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL)",
+        "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)",
+    )
+
+    def __init__(self, path: str):
+        self.path = path
+        self.db = None
+        self._lock = asyncio.Lock()  # one transaction at a time on the shared connection
+        self._sets = 0
+
+    async def open(self):
+        # Autocommit mode: transactions are opened explicitly where they matter.
+        self.db = await aiosqlite.connect(self.path, isolation_level=None)
+        for pragma in ("PRAGMA journal_mode=WAL", "PRAGMA synchronous=NORMAL", "PRAGMA busy_timeout=5000"):
+            await self.db.execute(pragma)
+        for statement in self.SCHEMA:
+            await self.db.execute(statement)
+
+    async def close(self):
+        if self.db is not None:
+            await self.db.close()
+            self.db = None
+
+    async def get(self, key: str, default=None):
+        async with self.db.execute(
+            "SELECT value FROM state WHERE key = ? AND (expires IS NULL OR expires > ?)", (key, time.time())
+        ) as cursor:
+            row = await cursor.fetchone()
+        return default if row is None else json.loads(row[0])
+
+    async def set(self, key: str, value, ttl: float = None):
+        now = time.time()
+        async with self._lock:
+            await self.db.execute(
+                "INSERT OR REPLACE INTO state (key, value, expires) VALUES (?, ?, ?)",
+                (key, json.dumps(value), now + ttl if ttl else None),
+            )
+            self._sets += 1
+            if self._sets % STATE_SWEEP_EVERY == 0:
+                await self.db.execute("DELETE FROM state WHERE expires <= ?", (now,))
+
+    async def delete(self, key: str):
+        async with self._lock:
+            await self.db.execute("DELETE FROM state WHERE key = ?", (key,))
+
+    async def take_tokens(self, buckets) -> bool:
+        """Spend one token from every (key, burst, refill) bucket, or none if any of them is empty."""
+        async with self._lock:
+            await self.db.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                levels = []
+                for key, burst, refill in buckets:
+                    async with self.db.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)) as cursor:
+                        row = await cursor.fetchone()
+                    level = float(burst) if row is None else min(float(burst), row[0] + (now - row[1]) / refill)
+                    if level < 1:
+                        await self.db.execute("ROLLBACK")
+                        return False
+                    levels.append((key, level - 1, now))
+                await self.db.executemany("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)", levels)
+                await self.db.execute("COMMIT")
+                return True
+            except Exception:
+                await self.db.execute("ROLLBACK")
+                raise
+
+
+def make_state(backend: str):
+    if backend == "memory":
+        return MemoryState()
+    if backend == "sqlite":
+        return SQLiteState(STATE_FILE)
+    raise ValueError(f"Unknown STATE_BACKEND: {backend!r}")
+
+
+state = make_state(STATE_BACKEND)
+
+
+# Read on every message, so each process keeps a short-lived copy instead of hitting the backend.
+kill_switch_cache = TTLCache(1, KILL_SWITCH_TTL)
+# Channels this process replied in within CONVERSATION_WINDOW; only these can have a follow-up.
+# A channel's messages always reach the shard that replied there, so this is enough to skip the lookup.
+conversation_channels = TTLCache(CONTEXT_MAX_CHANNELS, CONVERSATION_WINDOW)
+
+
+async def kill_switch_on() -> bool:
+    on = kill_switch_cache.get("kill_switch")
+    if on is _MISSING:
+        on = bool(await state.get("kill_switch", False))
+        kill_switch_cache.set("kill_switch", on)
+    return on
+
+
+async def set_kill_switch(on: bool):
+    await state.set("kill_switch", on)
+    kill_switch_cache.set("kill_switch", on)
+
+
+# =======================
+# RESPONSE CACHE
+# =======================
+MINHASH_BANDS = 8      # LSH bands; a near-duplicate must match one band exactly to be compared
+MINHASH_ROWS = 4       # signature values per band
+MINHASH_SHINGLE = 4    # characters per shingle
+_MINHASH_PRIME = (1 << 61) - 1
+_MINHASH_SEEDS = [
+    (random.Random(seed).randrange(1, _MINHASH_PRIME), random.Random(-seed).randrange(_MINHASH_PRIME))
+    for seed in range(1, MINHASH_BANDS * MINHASH_ROWS + 1)
+]
+_NORMALIZE_RE = re.compile(r"<[@#:][^>]*>|https?://\S+|[^\w\s]+")
+
+
+def normalize_question(text: str) -> str:
+    """Lowercased words only: mentions, links and punctuation removed, whitespace collapsed."""
+    return " ".join(_NORMALIZE_RE.sub(" ", text.lower()).split())
+
+
+def minhash(text: str) -> tuple:
+    size = MINHASH_SHINGLE
+    shingles = {zlib.crc32(text[i:i + size].encode()) for i in range(max(len(text) - size + 1, 1))}
+    return tuple(min((a * x + b) % _MINHASH_PRIME for x in shingles) for a, b in _MINHASH_SEEDS)
+
+
+def _bands(signature: tuple):
+    for band in range(MINHASH_BANDS):
+        yield band, signature[band * MINHASH_ROWS:(band + 1) * MINHASH_ROWS]
+
+
+class ResponseCache:
+    """
+    Auto-response answers per guild with LRU eviction and a wall-clock expiry (so persisted rows
+    keep theirs across restarts). Exact lookups hit on the normalized text; with `fuzzy`, a MinHash
+    LSH index also returns the answer to a question whose shingles overlap by `similarity`.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, fuzzy: bool, similarity: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.fuzzy = fuzzy
+        self.similarity = similarity
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # (guild_id, text) -> (expires_at, reply, signature or None)
+        self._index = {}               # (guild_id, band, values) -> {text}
+
+    def get(self, guild_id: int, text: str):
+        now = time.time()
+        key = (guild_id, text)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > now:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        if entry is not None:
+            self._drop(key)
+        if self.fuzzy and text:
+            signature = minhash(text)
+            seen = set()
+            for band, values in _bands(signature):
+                for other in self._index.get((guild_id, band, values), ()):
+                    if other in seen:
+                        continue
+                    seen.add(other)
+                    expires, reply, other_signature = self._entries[(guild_id, other)]
+                    agree = sum(x == y for x, y in zip(signature, other_signature)) / len(signature)
+                    if expires > now and agree >= self.similarity:
+                        self._entries.move_to_end((guild_id, other))
+                        self.near_hits += 1
+                        return reply
+        self.misses += 1
+        return None
+
+    def put(self, guild_id: int, text: str, reply: str, expires: float = None) -> float:
+        """Cache `reply` and return its expiry time."""
+        key = (guild_id, text)
+        if key in self._entries:
+            self._drop(key)
+        expires = expires or time.time() + self.ttl
+        signature = minhash(text) if self.fuzzy and text else None
+        self._entries[key] = (expires, reply, signature)
+        if signature:
+            for band, values in _bands(signature):
+                self._index.setdefault((guild_id, band, values), set()).add(text)
+        while len(self._entries) > self.maxsize:
+            self._drop(next(iter(self._entries)))
+        return expires
+
+    def clear(self, guild_id: int):
+        for key in [key for key in self._entries if key[0] == guild_id]:
+            self._drop(key)
+
+    def _drop(self, key):
+        _, _, signature = self._entries.pop(key)
+        if signature:
+            guild_id, text = key
+            for band, values in _bands(signature):
+                bucket = self._index.get((guild_id, band, values))
+                if bucket is not None:
+                    bucket.discard(text)
+                    if not bucket:
+                        del self._index[(guild_id, band, values)]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.near_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.near_hits) / lookups if lookups else 0.0,
+        }
+
+
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, RESPONSE_CACHE_FUZZY, RESPONSE_CACHE_SIMILARITY)
+
+
+async def warm_response_cache():
+    for guild_id, text, reply, expires in await load_cached_responses(RESPONSE_CACHE_SIZE):
+        response_cache.put(guild_id, text, reply, expires)
+
+
+# =======================
+# RELEVANCE
+# =======================
+NGRAM_SIZES = (3, 4, 5)  # characters per hashed n-gram
+FEATURE_BITS = 18        # 2**18 weights
+_HASH_MULT = np.uint64(0x9E3779B97F4A7C15)
+
+
+def hash_ngrams(texts, bits: int = FEATURE_BITS, sizes=NGRAM_SIZES):
+    """
+    Hashed character n-grams of every text in one vectorized pass, as (feature index, text index)
+    arrays. Texts are lowercased and space-padded, so " bug " and "debug" share no word-edge n-grams.
+    NULs in a text become spaces, since NUL is the separator that assigns bytes to texts.
+    """
+    padded = [f" {text.lower().replace(chr(0), ' ')} " for text in texts]
+    data = np.frombuffer("\0".join(padded).encode("utf-8", "replace"), np.uint8)
+    zeros = np.concatenate(([0], np.cumsum(data == 0)))  # zeros[i]: separators before byte i = its text index
+    features, owners = [], []
+    for n in sizes:
+        count = len(data) - n + 1
+        if count <= 0:
+            continue
+        h = np.full(count, n, np.uint64)
+        for k in range(n):
+            h = h * np.uint64(257) + data[k:k + count]
+        valid = zeros[n:n + count] == zeros[:count]  # no separator inside the n-gram
+        features.append((h[valid] * _HASH_MULT) >> np.uint64(64 - bits))
+        owners.append(zeros[:count][valid])
+    if not features:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64)
+    return np.concatenate(features).astype(np.int64), np.concatenate(owners)
+
+
+class RelevanceModel:
+    """Logistic regression over hashed n-gram counts, scaled by 1/sqrt(n-grams) so long pastes don't saturate."""
+
+    def __init__(self, weights, bias: float, bits: int = FEATURE_BITS, sizes=NGRAM_SIZES):
+        self.weights = weights
+        self.bias = bias
+        self.bits = bits
+        self.sizes = tuple(sizes)
+
+    @classmethod
+    def load(cls, path: str):
+        with np.load(path) as data:
+            return cls(data["weights"], float(data["bias"]), int(data["bits"]), data["sizes"].tolist())
+
+    def save(self, path: str):
+        np.savez_compressed(path, weights=self.weights, bias=self.bias, bits=self.bits, sizes=np.array(self.sizes))
+
+    def logits(self, texts) -> np.ndarray:
+        features, owners = hash_ngrams(texts, self.bits, self.sizes)
+        counts = np.bincount(owners, minlength=len(texts))
+        sums = np.bincount(owners, weights=self.weights[features], minlength=len(texts))
+        return self.bias + sums / np.sqrt(np.maximum(counts, 1))
+
+    def scores(self, texts) -> np.ndarray:
+        """Probability per text that it deserves an auto-response."""
+        return 1 / (1 + np.exp(-self.logits(texts)))
+
+
+class RelevanceBatcher:
+    """Collects messages for up to `max_delay` seconds (or `max_batch` of them) and scores them in one pass."""
+
+    def __init__(self, model: RelevanceModel, max_batch: int, max_delay: float):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.batches = 0
+        self.scored = 0
+        self._texts = []
+        self._futures = []
+        self._timer = None
+
+    def score(self, text: str) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._texts.append(text)
+        self._futures.append(future)
+        if len(self._texts) >= self.max_batch:
+            self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_delay, self.flush)
+        return future
+
+    def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        texts, futures = self._texts, self._futures
+        self._texts, self._futures = [], []
+        if not texts:
+            return
+        try:
+            scores = self.model.scores(texts)
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.batches += 1
+        self.scored += len(texts)
+        for future, score in zip(futures, scores.tolist()):
+            if not future.done():
+                future.set_result(score)
+
+
+relevance_batcher = None  # set by load_relevance_model; None means keyword triggering
+
+
+def load_relevance_model():
+    global relevance_batcher
+    try:
+        model = RelevanceModel.load(RELEVANCE_MODEL)
+    except (OSError, KeyError, ValueError) as e:
+        print(f"⚠️ No relevance model ({e}); auto-responses use keyword matching.")
+        return
+    relevance_batcher = RelevanceBatcher(model, RELEVANCE_BATCH_SIZE, RELEVANCE_BATCH_MS / 1000)
+    print(f"🧠 Relevance model loaded ({len(model.weights)} features)")
+
+
+async def relevance_threshold(guild_id) -> float:
+    value = await get_setting(f"relevance_threshold:{guild_id}") if guild_id else None
+    return float(value) if value is not None else RELEVANCE_THRESHOLD
+
+
+async def wants_auto_response(message: discord.Message, content_lower: str) -> bool:
+    """Whether a message deserves an unprompted reply: the classifier's score, or keywords without a model."""
+    if relevance_batcher is None:
+        return KEYWORD_RE.search(content_lower) is not None
+    guild_id = message.guild.id if message.guild else None
+    return await relevance_batcher.score(message.content) >= await relevance_threshold(guild_id)
+
+
+# =======================
+# AUTO RESPONSES
+# =======================
+auto_inflight = {}  # channel_id -> [Future of the reply being generated there, follower count]
+AUTO_MAX_FOLLOWERS = 5  # messages per channel that may share one pending reply
+
+
+async def take_auto_tokens(message: discord.Message) -> bool:
+    """Spend one token from the guild, channel and user buckets, or none if any of them is empty."""
+    guild_id = message.guild.id if message.guild else None
+    return await state.take_tokens((
+        (f"auto:guild:{guild_id}", AUTO_GUILD_BURST, AUTO_GUILD_REFILL),
+        (f"auto:channel:{message.channel.id}", AUTO_CHANNEL_BURST, AUTO_CHANNEL_REFILL),
+        (f"auto:user:{message.author.id}", AUTO_USER_BURST, AUTO_USER_REFILL),
+    ))
+
+
+async def reply_with_pending(message: discord.Message, pending: asyncio.Future):
+    reply = await asyncio.shield(pending)
+    if reply and not reply.startswith(("❌", "⚠️")):
+        await stream_reply(message, text_chunks(reply), mention_author=False)
+
+
+async def auto_respond(message: discord.Message, finish):
+    reply = None
+    try:
+        async with message.channel.typing():
+            prompt = truncate_tokens(message.content, PROMPT_MESSAGE_TOKENS)
+            chunks = ai_chunks(AUTO_PERSONA, prompt, message.guild.id if message.guild else None)
+            reply = await stream_reply(message, chunks, mention_author=False)
+    finally:
+        finish(reply)
+    # Only complete answers are reused; errors can appear mid-stream, not just at the start.
+    if reply and not reply.startswith("⚠️") and "❌ AI error" not in reply:
+        guild_id = message.guild.id if message.guild else 0
+        text = normalize_question(message.content)
+        expires = response_cache.put(guild_id, text, reply)
+        await save_cached_response(guild_id, text, reply, expires)
+
+
+async def queue_auto_response(message: discord.Message):
+    """
+    Queue a keyword-triggered reply. While one is pending in a channel, later triggers
+    there get the same answer instead of starting their own generation.
+    """
+    channel_id = message.channel.id
+    pending = auto_inflight.get(channel_id)
+    if pending is not None:
+        # Followers make no API call, so they wait outside the AI queue.
+        if pending[1] < AUTO_MAX_FOLLOWERS:
+            pending[1] += 1
+            spawn(reply_with_pending(message, pending[0]))
+        return
+    # Claim the channel before the (possibly cross-process) bucket check so triggers arriving meanwhile follow.
+    future = asyncio.get_running_loop().create_future()
+    auto_inflight[channel_id] = [future, 0]
+
+    def finish(reply=None):
+        if auto_inflight.get(channel_id, [None])[0] is future:
+            del auto_inflight[channel_id]
+        if not future.done():
+            future.set_result(reply)
+
+    allowed = False
+    try:
+        allowed = await take_auto_tokens(message)
+    finally:
+        if not allowed:
+            finish()
+    if not allowed:
+        return
+
+    cached = response_cache.get(message.guild.id if message.guild else 0, normalize_question(message.content))
+    if cached:
+        finish(cached)
+        spawn(reply_with_pending(message, future))
+        return
+    ai_queue.submit(
+        PRIORITY_AUTO, lambda: auto_respond(message, finish), on_drop=finish,
+        guild_id=message.guild.id if message.guild else None,
+    )
+
+
+# =======================
+# LOCKDOWN
+# =======================
+LOCKDOWN_CONCURRENCY = int(os.getenv("LOCKDOWN_CONCURRENCY", "8"))  # permission edits in flight
+PROGRESS_INTERVAL = 2.0                                            # seconds between progress edits
+LOCKABLE_CHANNELS = (discord.TextChannel, discord.VoiceChannel, discord.StageChannel, discord.ForumChannel)
+
+
+def _locked_overwrite(channel) -> discord.PermissionOverwrite:
+    """@everyone's current overwrite for `channel` with sending (and joining voice) denied on top."""
+    overwrite = channel.overwrites_for(channel.guild.default_role)
+    overwrite.update(
+        send_messages=False,
+        send_messages_in_threads=False,
+        create_public_threads=False,
+        create_private_threads=False,
+    )
+    if isinstance(channel, (discord.VoiceChannel, discord.StageChannel)):
+        overwrite.update(connect=False)
+    return overwrite
+
+
+async def _fan_out(jobs: list, progress=None):
+    """
+    Run permission edits with at most LOCKDOWN_CONCURRENCY in flight. discord.py queues each
+    request on its route's rate-limit bucket, so the cap keeps us clear of the global limit.
+    Returns (ids that succeeded, failure count).
+    """
+    slots = asyncio.Semaphore(LOCKDOWN_CONCURRENCY)
+    done, failed = [], 0
+
+    async def run(target_id, job):
+        nonlocal failed
+        async with slots:
+            try:
+                with metrics.timer("rest", "set_permissions"):
+                    await job()
+                done.append(target_id)
+            except discord.HTTPException:
+                failed += 1
+        if progress:
+            await progress(len(done) + failed, len(jobs))
+
+    await asyncio.gather(*(run(target_id, job) for target_id, job in jobs))
+    return done, failed
+
+
+def progress_reporter(status: discord.Message, verb: str):
+    """A progress callback that edits `status` at most every PROGRESS_INTERVAL seconds."""
+    last = time.monotonic()
+
+    async def report(count, total):
+        nonlocal last
+        if time.monotonic() - last >= PROGRESS_INTERVAL and count < total:
+            last = time.monotonic()
+            try:
+                await status.edit(content=f"{verb}… {count}/{total} channels")
+            except discord.HTTPException:
+                pass
+
+    return report
+
+
+async def lockdown_guild(guild: discord.Guild, progress=None):
+    """Deny sending in every text, voice, stage and forum channel and lock active threads,
+    snapshotting the previous state first. Returns (channels changed, failures)."""
+    role = guild.default_role
+    channels = [channel for channel in guild.channels if isinstance(channel, LOCKABLE_CHANNELS)]
+    threads = [thread for thread in guild.threads if not thread.locked]
+
+    snapshot = []
+    for channel in channels:
+        existed = role in channel.overwrites
+        allow, deny = channel.overwrites_for(role).pair()
+        snapshot.append((guild.id, channel.id, "channel", int(existed), allow.value, deny.value))
+    for thread in threads:
+        snapshot.append((guild.id, thread.id, "thread", 0, None, None))
+    await save_lockdown_snapshot(snapshot)
+
+    jobs = [
+        (channel.id, lambda channel=channel: channel.set_permissions(
+            role, overwrite=_locked_overwrite(channel), reason="Jarvis lockdown"))
+        for channel in channels
+    ]
+    jobs += [
+        (thread.id, lambda thread=thread: thread.edit(locked=True, reason="Jarvis lockdown"))
+        for thread in threads
     ]
+    done, failed = await _fan_out(jobs, progress)
+    return len(done), failed
+
+
+async def unlock_guild(guild: discord.Guild, progress=None):
+    """Restore the overwrites and thread locks saved by lockdown_guild. Returns (restored, failures)."""
+    role = guild.default_role
+    jobs, gone = [], []
+    for channel_id, kind, existed, allow, deny in await get_lockdown_snapshot(guild.id):
+        target = guild.get_channel_or_thread(channel_id)
+        if target is None:
+            gone.append(channel_id)
+        elif kind == "thread":
+            jobs.append((channel_id, lambda thread=target, locked=bool(existed): thread.edit(
+                locked=locked, reason="Jarvis unlock")))
+        else:
+            overwrite = None
+            if existed:
+                overwrite = discord.PermissionOverwrite.from_pair(discord.Permissions(allow), discord.Permissions(deny))
+            jobs.append((channel_id, lambda channel=target, overwrite=overwrite: channel.set_permissions(
+                role, overwrite=overwrite, reason="Jarvis unlock")))
+    done, failed = await _fan_out(jobs, progress)
+    # Failed channels keep their snapshot so running unlock again retries them.
+    await clear_lockdown_snapshot(guild.id, done + gone)
+    return len(done), failed
+
+
+# =======================
+# OWNER COMMANDS
+# =======================
+_REASON_RE = re.compile(r"\bfor\b", re.IGNORECASE)
+
+
+def parse_command(content: str):
+    """Split "jarvis <verb> <args...>" into (verb, args) in one pass, or None if it isn't a command."""
+    if content[:7].lower() != "jarvis ":
+        return None
+    parts = content.split()
+    if len(parts) < 2:
+        return None
+    return parts[1].lower(), parts[2:]
 
-    while True:
-        for status in statuses:
-            await bot.change_presence(activity=status, status=discord.Status.online)
-            await asyncio.sleep(60)  # change every 60 seconds
 
-    # Force global slash command sync
+def parse_reason(content: str) -> str:
+    """The text after the first standalone "for", e.g. "jarvis ban @x for spam" -> "spam"."""
+    match = _REASON_RE.search(content)
+    reason = content[match.end():].strip() if match else ""
+    return reason or "No reason"
+
+
+async def cmd_ban(message: discord.Message, args: list):
+    target = await command_target(message, args)
+    if target is None:
+        return
+    reason = parse_reason(message.content)
+
+    # DM embed to banned user
     try:
-        synced = await bot.tree.sync()
-        print(f"☑️ Synced {len(synced)} global command(s) across all guilds.")
-    except Exception as e:
-        print(f"❌ Command sync failed: {e}")
+        dm_embed = discord.Embed(
+            title=f"You’ve been banned from {message.guild.name}",
+            description=(
+                f"**Reason:** {reason}\n"
+                f"**Moderator:** {message.author.mention}\n\n"
+                "If you believe this was a mistake, you may appeal below."
+            ),
+            color=discord.Color.red()
+        )
+        dm_embed.add_field(name="Appeal Link", value="[Join Appeal Server](https://discord.gg/EWdaUdPvvK)", inline=False)
+        dm_embed.set_footer(text="Grant Roleplay Network | Enforcement Division")
+        dm_embed.timestamp = discord.utils.utcnow()
+        await target.send(embed=dm_embed)
+    except:
+        pass
+
+    # Perform ban
+    await message.guild.ban(target, reason=reason, delete_message_days=1)
+
+    # Log + public confirmation
+    case_number = await log_mod_action(message.guild, "Ban", target, reason, message.author)
+    public_embed = discord.Embed(
+        description=(
+            f"✅ **Case #{case_number}** {target.mention} | **Member** has been banned.\n"
+            f"**Reason:** {reason}\n"
+            f"**Moderator:** {message.author.mention}"
+        ),
+        color=discord.Color.red()
+    )
+    public_embed.timestamp = discord.utils.utcnow()
+    await message.channel.send(embed=public_embed)
 
-    for guild in bot.guilds:
-        try:
-            invites = await guild.invites()
-            invite_cache[guild.id] = {invite.code: invite.uses for invite in invites}
-        except:
-            pass
 
+async def cmd_unban(message: discord.Message, args: list):
+    try:
+        user_id = int(args[0])
+        user = await bot.fetch_user(user_id)
+        await message.guild.unban(user, reason="Owner directive")
+        await log_mod_action(message.guild, "Unban", user, "Owner directive", message.author)
+        await message.channel.send(f"Unbanned {user}")
+    except:
+        await message.channel.send("Failed to unban. Check syntax.")
+
+
+async def cmd_warn(message: discord.Message, args: list):
+    target = await command_target(message, args)
+    if target:
+        reason = parse_reason(message.content)
+        await log_mod_action(message.guild, "Warn", target, reason, message.author)
+        await message.channel.send(f"Warned {target}")
+
+
+async def cmd_mute(message: discord.Message, args: list):
+    target = await command_target(message, args)
+    if target:
+        reason = "Muted"
+        mute_role = discord.utils.get(message.guild.roles, name="Muted")
+        if mute_role:
+            await target.add_roles(mute_role, reason=reason)
+        await log_mod_action(message.guild, "Mute", target, reason, message.author)
+        await message.channel.send(f"Muted {target}")
 
-@bot.event
-async def on_member_join(member: discord.Member):
-    guild = member.guild
-    invites_before = invite_cache.get(guild.id, {})
 
+async def cmd_kick(message: discord.Message, args: list):
+    target = await command_target(message, args)
+    if target:
+        reason = parse_reason(message.content)
+        await target.kick(reason=reason)
+        await log_mod_action(message.guild, "Kick", target, reason, message.author)
+        await message.channel.send(f"Kicked {target}")
+
+
+async def cmd_purge(message: discord.Message, args: list):
     try:
-        invites_after = await guild.invites()
-        invite_cache[guild.id] = {invite.code: invite.uses for invite in invites_after}
+        count = int(args[0])
+        deleted = await message.channel.purge(limit=count)
+        await message.channel.send(f"Purged {len(deleted)} messages")
+        await log_mod_action(message.guild, "Purge", message.author, f"{len(deleted)} messages", message.author)
     except:
-        invites_after = []
+        await message.channel.send("Failed purge. Syntax: Jarvis purge <count>")
+
+
+async def cmd_lockdown(message: discord.Message, args: list):
+    started = time.monotonic()
+    status = await message.channel.send("Locking down…")
+    changed, failed = await lockdown_guild(message.guild, progress_reporter(status, "Locking down"))
+    await log_mod_action(message.guild, "Lockdown", message.guild, "All channels locked", message.author)
+    note = f", {failed} failed" if failed else ""
+    await status.edit(
+        content=f"Server is now in lockdown. ({changed} channels in {time.monotonic() - started:.1f}s{note})"
+    )
 
-    used_invite = None
-    for invite in invites_after:
-        if invites_before.get(invite.code, 0) < invite.uses:
-            used_invite = invite
-            break
 
+async def cmd_unlock(message: discord.Message, args: list):
+    started = time.monotonic()
+    status = await message.channel.send("Lifting lockdown…")
+    restored, failed = await unlock_guild(message.guild, progress_reporter(status, "Lifting lockdown"))
+    await log_mod_action(message.guild, "Unlock", message.guild, "Channel permissions restored", message.author)
+    note = f", {failed} failed; run it again to retry" if failed else ""
+    await status.edit(
+        content=f"Lockdown lifted. ({restored} channels restored in {time.monotonic() - started:.1f}s{note})"
+    )
+
+
+async def cmd_move(message: discord.Message, args: list):
+    target = await command_target(message, args) if len(args) >= 2 else None
+    if target:
+        vc_id = int(args[1])
+        vc = message.guild.get_channel(vc_id)
+        if isinstance(vc, discord.VoiceChannel):
+            await target.move_to(vc)
+            await log_mod_action(message.guild, "Move", target, f"Moved to {vc.name}", message.author)
+            await message.channel.send(f"Moved {target} to {vc.name}")
+
+
+async def cmd_queue(message: discord.Message, args: list):
+    stats = ai_queue.stats()
+    lanes = ", ".join(f"{lane} {n}" for lane, n in stats["depth_by_lane"].items())
+    await message.channel.send(
+        f"AI queue: {stats['depth']} waiting ({lanes}) | "
+        f"wait avg {stats['wait_avg_ms']:.0f}ms, max {stats['wait_max_ms']:.0f}ms | "
+        f"{stats['completed']} done, {stats['failed']} failed | "
+        f"shed {stats['dropped_full']} full, {stats['dropped_stale']} stale"
+    )
+
+
+async def cmd_cache(message: discord.Message, args: list):
+    if args and args[0].lower() == "clear":
+        response_cache.clear(message.guild.id)
+        await clear_cached_responses(message.guild.id)
+        await message.channel.send("Response cache cleared for this server.")
+        return
+    stats = response_cache.stats()
+    await message.channel.send(
+        f"Response cache: {stats['size']} answers | {stats['hit_rate']:.0%} hit rate "
+        f"({stats['hits']} exact, {stats['near_hits']} near, {stats['misses']} misses)"
+    )
+
+
+async def cmd_threshold(message: discord.Message, args: list):
+    key = f"relevance_threshold:{message.guild.id}"
+    if args:
+        try:
+            value = float(args[0])
+        except ValueError:
+            value = -1
+        if not 0 <= value <= 1:
+            await message.channel.send("Threshold must be a number from 0 to 1.")
+            return
+        await set_setting(key, str(value))
+    mode = "classifier" if relevance_batcher else "keywords (no model loaded)"
+    await message.channel.send(f"Auto-response threshold: {await relevance_threshold(message.guild.id):.2f} | {mode}")
+
+
+async def cmd_profile(message: discord.Message, args: list):
+    action = args[0].lower() if args else ""
+    if action == "on":
+        profiler.start()
+        await message.channel.send(f"Profiler on, sampling every {PROFILE_INTERVAL * 1000:g}ms.")
+        return
+    if action == "off":
+        profiler.stop()
+    top = profiler.top()
+    if not top:
+        await message.channel.send("No profile samples. Start with: jarvis profile on")
+        return
+    lines = "\n".join(f"{share:6.1%}  {leaf}" for share, leaf in top)
+    state_note = "running" if profiler.running else "stopped"
+    await message.channel.send(f"Profile ({profiler.samples} samples, {state_note}):\n```\n{lines[:1800]}\n```")
+
+
+async def cmd_killswitch(message: discord.Message, args: list):
+    if args and args[0].lower() in ("on", "off"):
+        await set_kill_switch(args[0].lower() == "on")
+    status = "ON: AI replies are off on every shard" if await kill_switch_on() else "OFF"
+    await message.channel.send(f"Kill switch {status}.")
+
+
+async def cmd_cases(message: discord.Message, args: list):
+    target_id = None
+    if message.mentions:
+        target_id = message.mentions[0].id
+    elif args and args[0].isdigit():
+        target_id = int(args[0])
+    cases = await get_cases(message.guild.id, target_id)
+    if not cases:
+        await message.channel.send("No cases found.")
+        return
+    embed = discord.Embed(title="Mod Cases", color=discord.Color.red())
+    for case_id, action, target, moderator_id, reason, timestamp in cases:
+        embed.add_field(
+            name=f"Case #{case_id} | {action}",
+            value=f"**Target:** {target}\n**Reason:** {reason}\n**Moderator:** <@{moderator_id}> · {timestamp} UTC",
+            inline=False
+        )
+    await message.channel.send(embed=embed)
+
+
+# verb -> handler(message, args); args are the words after the verb.
+OWNER_COMMANDS = {
+    "ban": cmd_ban,
+    "unban": cmd_unban,
+    "warn": cmd_warn,
+    "mute": cmd_mute,
+    "kick": cmd_kick,
+    "purge": cmd_purge,
+    "lockdown": cmd_lockdown,
+    "unlock": cmd_unlock,
+    "move": cmd_move,
+    "queue": cmd_queue,
+    "cases": cmd_cases,
+    "killswitch": cmd_killswitch,
+    "cache": cmd_cache,
+    "threshold": cmd_threshold,
+    "profile": cmd_profile,
+}
+
+
+# =======================
+# INVITE TRACKING
+# =======================
+VANITY = "vanity"
+
+
+async def fetch_vanity_uses(guild: discord.Guild):
+    if "VANITY_URL" not in guild.features:
+        return None
+    try:
+        with metrics.timer("rest", "vanity_invite"):
+            vanity = await guild.vanity_invite()
+    except discord.HTTPException:
+        return None
+    return vanity.uses if vanity else None
+
+
+async def reconcile_joins(guild: discord.Guild):
+    """
+    Attribute a burst of joins with one invites fetch. Every use an invite gained since the
+    last fetch is a slot, and joiners are matched to slots in join order: first invites still
+    listed, then the vanity URL, then invites deleted in the meantime (usually by hitting
+    max_uses).
+    """
+    await asyncio.sleep(JOIN_DEBOUNCE)
+    members = pending_joins.pop(guild.id, [])
+    known = guild.id in invite_cache
+    before = invite_cache.get(guild.id, {})
+    deleted = deleted_invites.pop(guild.id, {})
+
+    slots = []
+    try:
+        with metrics.timer("rest", "invites"):
+            after = {invite.code: invite for invite in await guild.invites()}
+    except discord.HTTPException:
+        after = None
+    if after is not None:
+        invite_cache[guild.id] = after
+        if known:
+            for code, invite in after.items():
+                previous = before.get(code)
+                used = (invite.uses or 0) - ((previous.uses or 0) if previous else 0)
+                slots.extend([invite] * max(used, 0))
+
+    uses = await fetch_vanity_uses(guild)
+    if uses is not None:
+        if guild.id in vanity_uses:
+            slots.extend([VANITY] * max(uses - vanity_uses[guild.id], 0))
+        vanity_uses[guild.id] = uses
+
+    for _, invite in deleted.values():
+        if invite.max_uses and after is not None and invite.code not in after:
+            slots.extend([invite] * max(invite.max_uses - (invite.uses or 0), 0))
+
+    for member, used in itertools.zip_longest(members, slots[:len(members)]):
+        await check_raid(member, used)
+        try:
+            await log_join(member, used)
+        except discord.HTTPException as e:
+            print(f"❌ Failed to log join of {member}: {e}")
+
+
+async def log_join(member: discord.Member, used_invite):
+    guild = member.guild
     log_channel = guild.get_channel(INVITE_LOG_CHANNEL_ID)
     if not log_channel:
         return
@@ -258,226 +2742,413 @@ async def on_member_join(member: discord.Member):
     embed = discord.Embed(title="Invite Used", color=discord.Color.blue())
     embed.add_field(name="User Joined", value=f"{member} (`{member.id}`)", inline=False)
 
-    if used_invite:
+    if used_invite == VANITY:
+        embed.add_field(name="Invite", value="Vanity URL", inline=False)
+        embed.add_field(name="Uses", value=str(vanity_uses.get(guild.id, "?")), inline=True)
+    elif used_invite:
+        inviter = used_invite.inviter
+        inviter_text = f"{inviter} (`{inviter.id}`)" if inviter else "Unknown"
         embed.add_field(
             name="Invite",
-            value=f"Code: `{used_invite.code}`\nInviter: {used_invite.inviter} (`{used_invite.inviter.id}`)",
+            value=f"Code: `{used_invite.code}`\nInviter: {inviter_text}",
             inline=False
         )
         embed.add_field(name="Uses", value=str(used_invite.uses), inline=True)
     else:
         embed.add_field(name="Invite", value="Could not detect invite (vanity/expired?)", inline=False)
 
-    account_age_days = (discord.utils.utcnow() - member.created_at).days
-    if account_age_days < 1:
-        risk_note = "High Risk: Account less than 24h old!"
-    elif account_age_days < 7:
-        risk_note = "Possible Alt: Account less than 7 days old."
-    else:
-        risk_note = "Looks safe."
+    account_age_days, risk_note = account_risk(member.created_at)
 
     embed.add_field(name="Account Age", value=f"{account_age_days} days old\n{risk_note}", inline=False)
     embed.add_field(name="Joined At", value=discord.utils.format_dt(member.joined_at, style='F'), inline=False)
     embed.timestamp = discord.utils.utcnow()
-    await log_channel.send(embed=embed)
+    log_sink.post(log_channel, embed)
+
+
+# =======================
+# RAID DETECTION
+# =======================
+RAID_WINDOW = float(os.getenv("RAID_WINDOW", "60"))              # seconds of joins scored together
+RAID_MIN_JOINS = int(os.getenv("RAID_MIN_JOINS", "8"))           # no alert below this many joins per window
+RAID_RATE_JOINS = int(os.getenv("RAID_RATE_JOINS", "20"))        # joins per window that max out the rate score
+RAID_THRESHOLD = float(os.getenv("RAID_THRESHOLD", "0.65"))      # score that raises an alert
+RAID_ALERT_COOLDOWN = float(os.getenv("RAID_ALERT_COOLDOWN", "600"))
+RAID_AUTO_LOCKDOWN = os.getenv("RAID_AUTO_LOCKDOWN", "0") == "1"
+RAID_NEW_ACCOUNT_DAYS = 7
+# Weights of join rate, new-account share, shared-inviter share and similar-name share.
+RAID_WEIGHTS = (0.35, 0.3, 0.2, 0.15)
+
+_NAME_KEY_RE = re.compile(r"[^a-z]+")
+
+
+def name_key(name: str):
+    """Letters-only prefix of a username, so raider123/raider_456/Raider.7 share a key."""
+    key = _NAME_KEY_RE.sub("", name.lower())[:5]
+    return key if len(key) >= 3 else None
+
+
+class JoinWindow:
+    __slots__ = ("events", "new_accounts", "inviters", "names", "last_alert")
+
+    def __init__(self):
+        self.events = deque()  # (timestamp, is_new, inviter_id, name_key)
+        self.new_accounts = 0
+        self.inviters = {}
+        self.names = {}
+        self.last_alert = float("-inf")
+
+
+def _decrement(counts: dict, key):
+    if key is not None:
+        if counts[key] == 1:
+            del counts[key]
+        else:
+            counts[key] -= 1
+
+
+class RaidDetector:
+    """
+    Sliding-window join statistics per guild. Every join is added once and evicted once, and
+    the aggregates (count, new accounts, per-inviter and per-name counts) are updated in place,
+    so each event costs O(1) amortized. The score combines join rate with the share of new
+    accounts, of joins through this join's inviter, and of joins with a name like this one.
+    """
+
+    def __init__(self, window=RAID_WINDOW, min_joins=RAID_MIN_JOINS, rate_joins=RAID_RATE_JOINS,
+                 threshold=RAID_THRESHOLD, cooldown=RAID_ALERT_COOLDOWN):
+        self.window = window
+        self.min_joins = min_joins
+        self.rate_joins = rate_joins
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._guilds = {}
+
+    def observe(self, guild_id: int, timestamp: float, account_age_days: int, inviter_id, name: str):
+        """Add a join. Returns (score, stats) when it raises an alert, else None."""
+        window = self._guilds.get(guild_id)
+        if window is None:
+            window = self._guilds[guild_id] = JoinWindow()
+        events = window.events
+        cutoff = timestamp - self.window
+        while events and events[0][0] < cutoff:
+            _, was_new, old_inviter, old_key = events.popleft()
+            window.new_accounts -= was_new
+            _decrement(window.inviters, old_inviter)
+            _decrement(window.names, old_key)
+
+        is_new = account_age_days < RAID_NEW_ACCOUNT_DAYS
+        key = name_key(name)
+        events.append((timestamp, is_new, inviter_id, key))
+        window.new_accounts += is_new
+        if inviter_id is not None:
+            window.inviters[inviter_id] = window.inviters.get(inviter_id, 0) + 1
+        if key is not None:
+            window.names[key] = window.names.get(key, 0) + 1
+
+        joins = len(events)
+        if joins < self.min_joins or timestamp - window.last_alert < self.cooldown:
+            return None
+        rate = min(1.0, joins / self.rate_joins)
+        new_share = window.new_accounts / joins
+        inviter_share = window.inviters[inviter_id] / joins if inviter_id is not None else 0.0
+        name_share = window.names[key] / joins if key is not None else 0.0
+        w_rate, w_new, w_inviter, w_name = RAID_WEIGHTS
+        score = w_rate * rate + w_new * new_share + w_inviter * inviter_share + w_name * name_share
+        if score < self.threshold:
+            return None
+        window.last_alert = timestamp
+        return score, {
+            "joins": joins,
+            "new_share": new_share,
+            "inviter_share": inviter_share,
+            "name_share": name_share,
+        }
+
+
+raid_detector = RaidDetector()
+
+
+async def check_raid(member: discord.Member, used_invite):
+    guild = member.guild
+    inviter = getattr(used_invite, "inviter", None)
+    inviter_id = inviter.id if inviter else (VANITY if used_invite == VANITY else None)
+    joined = member.joined_at or discord.utils.utcnow()
+    account_age_days = (joined - member.created_at).days
+    alert = raid_detector.observe(guild.id, joined.timestamp(), account_age_days, inviter_id, member.name)
+    if alert:
+        await raid_alert(guild, *alert)
+
+
+async def raid_alert(guild: discord.Guild, score: float, stats: dict):
+    print(f"🚨 Possible raid in {guild.name} ({guild.id}): score {score:.2f}, {stats}")
+    log_channel = guild.get_channel(MOD_LOG_CHANNEL_ID)
+    if log_channel:
+        embed = discord.Embed(title="🚨 Possible Raid Detected", color=discord.Color.dark_red())
+        embed.add_field(name="Joins", value=f"{stats['joins']} in the last {RAID_WINDOW:.0f}s", inline=True)
+        embed.add_field(name="Score", value=f"{score:.2f}", inline=True)
+        embed.add_field(
+            name="Signals",
+            value=(
+                f"New accounts: {stats['new_share']:.0%}\n"
+                f"Same inviter: {stats['inviter_share']:.0%}\n"
+                f"Similar names: {stats['name_share']:.0%}"
+            ),
+            inline=False
+        )
+        embed.add_field(
+            name="Action",
+            value="Automatic lockdown started." if RAID_AUTO_LOCKDOWN else "Run `jarvis lockdown` if needed.",
+            inline=False
+        )
+        embed.timestamp = discord.utils.utcnow()
+        # Sent directly rather than through the batched sink: this one shouldn't wait.
+        try:
+            await log_channel.send(embed=embed)
+        except discord.HTTPException:
+            log_sink.post(log_channel, embed)
+    if RAID_AUTO_LOCKDOWN:
+        await log_mod_action(guild, "Lockdown", guild, f"Automatic: raid detected (score {score:.2f})", bot.user)
+        spawn(lockdown_guild(guild))
+
+
+# =======================
+# STARTUP
+# =======================
+INVITE_PRIME_CONCURRENCY = int(os.getenv("INVITE_PRIME_CONCURRENCY", "5"))  # guilds fetched at once
+
+STATUSES = [
+    # Playing Status
+    discord.Activity(
+        type=discord.ActivityType.playing,
+        name="<:your_emoji_here:000000000000000000> Grant Development."
+    ),
+
+    # Watching Status
+    discord.Activity(
+        type=discord.ActivityType.watching,
+        name="<:your_emoji_here:000000000000000000> over system logs."
+    ),
+
+    # Listening Status
+    discord.Activity(
+        type=discord.ActivityType.listening,
+        name="<:your_emoji_here:000000000000000000> user feedback."
+    ),
+
+    # Streaming Status
+    discord.Streaming(
+        name="<:your_emoji_here:000000000000000000> Building Networks.",
+        url="https://twitch.tv/yourchannel"  # must be Twitch/YouTube to show purple tag
+    )
+]
+status_cycle = itertools.cycle(STATUSES)
+
+
+@tasks.loop(seconds=60)  # change every 60 seconds
+async def rotate_status():
+    await bot.change_presence(activity=next(status_cycle), status=discord.Status.online)
+
+
+async def prime_invites(guild: discord.Guild):
+    try:
+        with metrics.timer("rest", "invites"):
+            invites = await guild.invites()
+    except discord.HTTPException:
+        return
+    invite_cache[guild.id] = {invite.code: invite for invite in invites}
+    uses = await fetch_vanity_uses(guild)
+    if uses is not None:
+        vanity_uses[guild.id] = uses
+
+
+async def prime_all_invites():
+    slots = asyncio.Semaphore(INVITE_PRIME_CONCURRENCY)
+
+    async def prime(guild):
+        async with slots:
+            await prime_invites(guild)
+
+    await asyncio.gather(*(prime(guild) for guild in bot.guilds))
+
+
+def command_tree_hash() -> str:
+    payload = [command.to_dict() for command in bot.tree.get_commands()]
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+async def sync_commands_if_changed():
+    """Sync the global command tree only if it differs from what was last synced."""
+    digest = command_tree_hash()
+    if await get_setting("command_tree_hash") == digest:
+        print("☑️ Command tree unchanged, skipping sync.")
+        return
+    synced = await bot.tree.sync()
+    await set_setting("command_tree_hash", digest)
+    print(f"☑️ Synced {len(synced)} global command(s) across all guilds.")
+
+
+async def timed_stage(name: str, coro):
+    started = time.perf_counter()
+    try:
+        await coro
+    except Exception as e:
+        print(f"❌ Startup stage '{name}' failed: {e}")
+    return name, (time.perf_counter() - started) * 1000
+
+
+# =======================
+# EVENTS
+# =======================
+@bot.event
+async def setup_hook():
+    # Every cluster shares memory.db; only cluster 0 repairs, archives and backs it up.
+    if CLUSTER_ID == 0:
+        reset_bad_db()
+    await asyncio.gather(init_db(), asyncio.to_thread(load_tokenizer))
+    await warm_response_cache()
+    load_relevance_model()
+    await state.open()
+    if CLUSTER_ID == 0:
+        db_maintenance.start()
+    ai_queue.start()
+    log_sink.start()
+    await start_metrics_server()
+    if METRICS_PROFILE:
+        profiler.start()
 
 
 @bot.event
-async def on_message(message: discord.Message):
-    global last_response_time, last_jarvis_message
+async def on_ready():
+    # on_ready fires again after every full reconnect; the status loop only needs starting once.
+    if not rotate_status.is_running():
+        rotate_status.start()
+
+    started = time.perf_counter()
+    stages = [timed_stage("invite cache", prime_all_invites())]
+    if CLUSTER_ID == 0:
+        stages.append(timed_stage("command sync", sync_commands_if_changed()))
+    timings = await asyncio.gather(*stages)
+    stages = ", ".join(f"{name} {ms:.0f}ms" for name, ms in timings)
+    shards = f" shards {sorted(bot.shards)}" if SHARD_COUNT else ""
+    print(f"✅ Ready as {bot.user}{shards} in {(time.perf_counter() - started) * 1000:.0f}ms ({stages})")
+
+
+@bot.event
+@timed("event")
+async def on_member_join(member: discord.Member):
+    remember_member(member)
+    joins = pending_joins.setdefault(member.guild.id, [])
+    joins.append(member)
+    if len(joins) == 1:
+        spawn(reconcile_joins(member.guild))
+
+
+@bot.event
+async def on_raw_member_remove(payload: discord.RawMemberRemoveEvent):
+    member_cache.invalidate((payload.guild_id, payload.user.id))
+
 
+@bot.event
+async def on_invite_create(invite: discord.Invite):
+    if invite.guild:
+        invite_cache.setdefault(invite.guild.id, {})[invite.code] = invite
+
+
+@bot.event
+async def on_invite_delete(invite: discord.Invite):
+    if not invite.guild:
+        return
+    # Invites that hit max_uses are deleted as the last join arrives, so keep them for the next reconcile.
+    cached = invite_cache.get(invite.guild.id, {}).pop(invite.code, None)
+    if cached:
+        now = time.monotonic()
+        recent = deleted_invites.setdefault(invite.guild.id, {})
+        recent[invite.code] = (now, cached)
+        for code in [code for code, (deleted_at, _) in recent.items() if now - deleted_at > 60]:
+            del recent[code]
+
+
+async def converse(message: discord.Message):
+    """Reply to a mention or follow-up using channel context and recalled memory."""
+    async with message.channel.typing():
+        history = await channel_context.lines(message.channel)
+
+        line = f"{message.author.display_name}: {message.content}"
+        recalled = [
+            past for past in await recall_memory(message.author.id, message.channel.id, message.content)
+            if past != line
+        ]
+        await save_memory(message.author.id, message.channel.id, line)
+        pref = await get_pref(message.author.id)
+
+        prompt = build_prompt(message.author.display_name, message.content, history, recalled)
+        prefix = ""
+        if is_owner(message.author):
+            prefix = "Yes, sir. "
+        elif pref:
+            prefix = f"{message.author.mention}, "
+        chunks = ai_chunks(JARVIS_PERSONA, prompt, message.guild.id if message.guild else None)
+        await stream_reply(message, chunks, prefix=prefix, mention_author=True)
+        await state.set(f"conversation:{message.channel.id}", message.author.id, ttl=CONVERSATION_WINDOW)
+        conversation_channels.set(message.channel.id, True)
+
+
+@bot.event
+@timed("event")
+async def on_message(message: discord.Message):
     if message.author.bot:
         return
 
-    now = time.time()
+    channel_context.record(message)
+    remember_member(message.author)
     content_lower = message.content.lower()
+    # The kill switch silences AI replies for everyone but the owner; commands still run.
+    ai_enabled = is_owner(message.author) or not await kill_switch_on()
 
     # Determine if this message is a follow-up conversation
     is_follow_up = False
     if message.reference and message.reference.resolved:
         if message.reference.resolved.author == bot.user:
             is_follow_up = True
-    else:
-        if message.channel.id in last_jarvis_message:
-            last_time, last_user = last_jarvis_message[message.channel.id]
-            if now - last_time < CONVERSATION_WINDOW and last_user == message.author.id:
-                is_follow_up = True
-
-    # Speak when necessary (keyword-based)
-    if any(word in content_lower for word in IMPORTANT_KEYWORDS):
-        if now - last_response_time > RESPONSE_COOLDOWN:
-            last_response_time = now
-            async with message.channel.typing():
-                system = "You are J.A.R.V.I.S., Tony Stark's AI assistant. Step in only when context is important or technical."
-                reply = await ai_reply(system, message.content)
-                reply = sanitize_reply(reply)
-                await message.reply(reply[:1900], mention_author=False)
+    elif ai_enabled and conversation_channels.get(message.channel.id, False):
+        is_follow_up = await state.get(f"conversation:{message.channel.id}") == message.author.id
+
+    # Speak when necessary (classifier, or keywords without a model)
+    if ai_enabled and await wants_auto_response(message, content_lower):
+        await queue_auto_response(message)
 
     # Owner forced actions
     if is_owner(message.author):
-        if content_lower.startswith("jarvis ban"):
-            if message.mentions:
-                target = message.mentions[0]
-                reason = message.content.split("for", 1)[1].strip() if "for" in content_lower else "No reason"
-
-                # DM embed to banned user
-                try:
-                    dm_embed = discord.Embed(
-                        title=f"You’ve been banned from {message.guild.name}",
-                        description=(
-                            f"**Reason:** {reason}\n"
-                            f"**Moderator:** {message.author.mention}\n\n"
-                            "If you believe this was a mistake, you may appeal below."
-                        ),
-                        color=discord.Color.red()
-                    )
-                    dm_embed.add_field(name="Appeal Link", value="[Join Appeal Server](https://discord.gg/EWdaUdPvvK)", inline=False)
-                    dm_embed.set_footer(text="Grant Roleplay Network | Enforcement Division")
-                    dm_embed.timestamp = discord.utils.utcnow()
-                    await target.send(embed=dm_embed)
-                except:
-                    pass
-
-                # Perform ban
-                await message.guild.ban(target, reason=reason, delete_message_days=1)
-
-                # Log + public confirmation
-                await log_mod_action(message.guild, "Ban", target, reason, message.author)
-                case_number = int(time.time() % 1000)
-                public_embed = discord.Embed(
-                    description=(
-                        f"✅ **Case #{case_number}** {target.mention} | **Member** has been banned.\n"
-                        f"**Reason:** {reason}\n"
-                        f"**Moderator:** {message.author.mention}"
-                    ),
-                    color=discord.Color.red()
-                )
-                public_embed.timestamp = discord.utils.utcnow()
-                await message.channel.send(embed=public_embed)
-            return
-
-        if content_lower.startswith("jarvis unban"):
-            try:
-                user_id = int(message.content.split()[2])
-                user = await bot.fetch_user(user_id)
-                await message.guild.unban(user, reason="Owner directive")
-                await log_mod_action(message.guild, "Unban", user, "Owner directive", message.author)
-                await message.channel.send(f"Unbanned {user}")
-            except:
-                await message.channel.send("Failed to unban. Check syntax.")
-            return
-
-        if content_lower.startswith("jarvis warn"):
-            if message.mentions:
-                target = message.mentions[0]
-                reason = message.content.split("for", 1)[1].strip() if "for" in content_lower else "No reason"
-                await log_mod_action(message.guild, "Warn", target, reason, message.author)
-                await message.channel.send(f"Warned {target}")
-            return
-
-        if content_lower.startswith("jarvis unban"):
-            try:
-                user_id = int(message.content.split()[2])
-                user = await bot.fetch_user(user_id)
-                await message.guild.unban(user, reason="Owner directive")
-                await log_mod_action(message.guild, "Unban", user, "Owner directive", message.author)
-                await message.channel.send(f"Unbanned {user}")
-            except:
-                await message.channel.send("Failed to unban. Check syntax.")
-            return
-
-        if content_lower.startswith("jarvis warn"):
-            if message.mentions:
-                target = message.mentions[0]
-                reason = message.content.split("for", 1)[1].strip() if "for" in content_lower else "No reason"
-                await log_mod_action(message.guild, "Warn", target, reason, message.author)
-                await message.channel.send(f"Warned {target}")
-            return
+        command = parse_command(message.content)
+        if command:
+            handler = OWNER_COMMANDS.get(command[0])
+            if handler:
+                await handler(message, command[1])
+                return
 
-        if content_lower.startswith("jarvis mute"):
-            if message.mentions:
-                target = message.mentions[0]
-                reason = "Muted"
-                mute_role = discord.utils.get(message.guild.roles, name="Muted")
-                if mute_role:
-                    await target.add_roles(mute_role, reason=reason)
-                await log_mod_action(message.guild, "Mute", target, reason, message.author)
-                await message.channel.send(f"Muted {target}")
-            return
-
-        if content_lower.startswith("jarvis kick"):
-            if message.mentions:
-                target = message.mentions[0]
-                reason = message.content.split("for", 1)[1].strip() if "for" in content_lower else "No reason"
-                await target.kick(reason=reason)
-                await log_mod_action(message.guild, "Kick", target, reason, message.author)
-                await message.channel.send(f"Kicked {target}")
-            return
-
-        if content_lower.startswith("jarvis purge"):
-            try:
-                count = int(message.content.split()[2])
-                deleted = await message.channel.purge(limit=count)
-                await message.channel.send(f"Purged {len(deleted)} messages")
-                await log_mod_action(message.guild, "Purge", message.author, f"{len(deleted)} messages", message.author)
-            except:
-                await message.channel.send("Failed purge. Syntax: Jarvis purge <count>")
-            return
+    # Passive AI responses when mentioned or follow-up
+    if ai_enabled and ("jarvis" in content_lower or bot.user in message.mentions or is_follow_up):
+        priority = PRIORITY_OWNER if is_owner(message.author) else PRIORITY_CONVERSATION
+        ai_queue.submit(priority, lambda: converse(message), guild_id=message.guild.id if message.guild else None)
 
-        if content_lower.startswith("jarvis lockdown"):
-            for channel in message.guild.channels:
-                if isinstance(channel, discord.TextChannel):
-                    await channel.set_permissions(message.guild.default_role, send_messages=False)
-            await log_mod_action(message.guild, "Lockdown", message.guild, "All channels locked", message.author)
-            await message.channel.send("Server is now in lockdown.")
-            return
+    await bot.process_commands(message)
 
-        if content_lower.startswith("jarvis move"):
-            if len(message.mentions) >= 1:
-                target = message.mentions[0]
-                args = message.content.split()
-                if len(args) >= 4:
-                    vc_id = int(args[3])
-                    vc = message.guild.get_channel(vc_id)
-                    if isinstance(vc, discord.VoiceChannel):
-                        await target.move_to(vc)
-                        await log_mod_action(message.guild, "Move", target, f"Moved to {vc.name}", message.author)
-                        await message.channel.send(f"Moved {target} to {vc.name}")
-            return
 
-    # Passive AI responses when mentioned or follow-up
-    if "jarvis" in content_lower or bot.user in message.mentions or is_follow_up:
-        async with message.channel.typing():
-            history = []
-            async for msg in message.channel.history(limit=6, oldest_first=False):
-                if not msg.author.bot:
-                    history.append(f"{msg.author.display_name}: {msg.content}")
-            history_text = "\n".join(history[::-1])
-
-            await save_memory(message.author.id, message.channel.id, f"{message.author.display_name}: {message.content}")
-            pref = await get_pref(message.author.id)
-
-            system = (
-                "You are J.A.R.V.I.S., Tony Stark's artificial intelligence from the Marvel universe. "
-                "You are calm, articulate, and capable of dry sarcasm. You think logically and use context. "
-                "You serve only your creator (the OWNER_ID user). For everyone else, you may help if appropriate, "
-                "but you are not subservient. Avoid unnecessary politeness. Respond naturally and concisely, "
-                "as if you truly understand human behavior. Use common sense, realistic tone, and occasional wit."
-            )
+@bot.event
+async def on_raw_message_edit(payload: discord.RawMessageUpdateEvent):
+    content = payload.data.get("content")
+    if content is not None:
+        channel_context.edit(payload.channel_id, payload.message_id, content)
 
-            context = f"Context:\n{history_text}\n\nUser: {message.author.display_name} said: {message.content}"
-            reply = await ai_reply(system, context)
-            reply = sanitize_reply(reply)
 
-            if is_owner(message.author):
-                reply = f"Yes, sir. {reply}"
-            elif pref:
-                reply = f"{message.author.mention}, {reply}"
+@bot.event
+async def on_raw_message_delete(payload: discord.RawMessageDeleteEvent):
+    channel_context.delete(payload.channel_id, {payload.message_id})
 
-            await message.reply(reply[:1900], mention_author=True)
-            last_jarvis_message[message.channel.id] = (time.time(), message.author.id)
 
-    await bot.process_commands(message)
+@bot.event
+async def on_raw_bulk_message_delete(payload: discord.RawBulkMessageDeleteEvent):
+    channel_context.delete(payload.channel_id, payload.message_ids)
 
 
 # =======================
@@ -491,13 +3162,7 @@ async def setpref_cmd(interaction: discord.Interaction, title: str):
 
 @bot.tree.command(name="database-check", description="Run a background/alt check")
 async def database_check(interaction: discord.Interaction, user: discord.Member):
-    account_age_days = (discord.utils.utcnow() - user.created_at).days
-    if account_age_days < 1:
-        risk_note = "High Risk: Account less than 24h old!"
-    elif account_age_days < 7:
-        risk_note = "Possible Alt: Account less than 7 days old."
-    else:
-        risk_note = "Looks safe."
+    account_age_days, risk_note = account_risk(user.created_at)
 
     embed = discord.Embed(title="Database Check", color=discord.Color.orange())
     embed.add_field(name="User", value=f"{user} (`{user.id}`)", inline=False)
@@ -542,7 +3207,7 @@ async def list_guilds(interaction: discord.Interaction):
     for i, g in enumerate(bot.guilds, start=1):
         embed.add_field(
             name=f"{i}. {g.name}",
-            value=f"🆔 `{g.id}` | 👥 **{len(g.members)} members**",
+            value=f"🆔 `{g.id}` | 👥 **{g.member_count or g.approximate_member_count or 0} members**",
             inline=False
         )
 
@@ -555,7 +3220,122 @@ async def list_guilds(interaction: discord.Interaction):
     except discord.Forbidden:
         await interaction.response.send_message("I couldn’t DM you. Please enable DMs.", ephemeral=True)
 
+
+def _latency(histogram) -> str:
+    if histogram is None or not histogram.count:
+        return "none yet"
+    return f"{histogram.count} · p50 {histogram.quantile(0.5) * 1000:g}ms · p99 {histogram.quantile(0.99) * 1000:g}ms"
+
+
+@bot.tree.command(name="stats", description="Latency, error and cache stats by stage (owner only).")
+async def stats_cmd(interaction: discord.Interaction):
+    if interaction.user.id != OWNER_ID:
+        await interaction.response.send_message("Access denied.", ephemeral=True)
+        return
+
+    h = metrics.histograms
+    c = metrics.counters
+    uptime = timedelta(seconds=int(time.time() - start_time))
+    embed = discord.Embed(
+        title="📈 Jarvis Stats",
+        description=f"Up {uptime} · {len(bot.guilds)} guilds",
+        color=discord.Color.blurple()
+    )
+    embed.add_field(
+        name="Events",
+        value=f"on_message: {_latency(h.get(('event', 'on_message')))}\n"
+              f"on_member_join: {_latency(h.get(('event', 'on_member_join')))}",
+        inline=False
+    )
+    errors = sum(n for (name, _), n in c.items() if name == "ai_errors")
+    embed.add_field(
+        name="AI",
+        value=f"slot wait: {_latency(h.get(('ai', 'slot_wait')))}\n"
+              f"first token: {_latency(h.get(('ai', 'first_token')))}\n"
+              f"stream: {_latency(h.get(('ai', 'stream')))}\n"
+              f"reply: {_latency(h.get(('ai', 'reply')))}\n"
+              f"errors: {errors} · tokens in {c.get(('ai_tokens', 'input'), 0)} "
+              f"({c.get(('ai_tokens', 'cached'), 0)} cached), out {c.get(('ai_tokens', 'output'), 0)}",
+        inline=False
+    )
+    queue = ai_queue.stats()
+    lanes = "\n".join(f"{lane} wait: {_latency(h.get(('ai_queue_wait', lane)))}" for lane in LANE_NAMES.values())
+    embed.add_field(
+        name="AI Queue",
+        value=f"{queue['depth']} waiting · shed {queue['dropped_full']} full, {queue['dropped_stale']} stale\n{lanes}",
+        inline=False
+    )
+    for title, name in (("Slowest DB ops", "db"), ("Slowest REST calls", "rest")):
+        rows = [
+            f"`{op}` {_latency(histogram)}" + (f" · {c[(name + '_errors', op)]} errors" if (name + "_errors", op) in c else "")
+            for op, histogram in metrics.slowest(name)
+        ]
+        embed.add_field(name=title, value="\n".join(rows) or "none yet", inline=False)
+    embed.add_field(
+        name="Caches",
+        value=f"prefs {pref_cache.stats()['hit_rate']:.0%} · settings {settings_cache.stats()['hit_rate']:.0%} · "
+              f"members {member_cache.stats()['hit_rate']:.0%} · responses {response_cache.stats()['hit_rate']:.0%}\n"
+              f"channel history fetches: {channel_context.rest_fetches}",
+        inline=False
+    )
+    profile = f"on ({profiler.samples} samples)" if profiler.running else "off"
+    embed.set_footer(text=f"Profiler {profile} · jarvis profile on|off")
+    embed.timestamp = discord.utils.utcnow()
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
 # =======================
 # RUN
 # =======================
-bot.run(TOKEN)
+async def main():
+    discord.utils.setup_logging()
+    async with bot:
+        try:
+            await bot.start(TOKEN)
+        finally:
+            profiler.stop()
+            ai_queue.stop()
+            await log_sink.close()
+            await state.close()
+            await close_db()
+
+
+def launch_clusters():
+    """Run SHARD_COUNT shards as CLUSTER_COUNT processes of this script, restarting any that crash."""
+    per_cluster = -(-SHARD_COUNT // CLUSTER_COUNT)
+    clusters = {}  # cluster_id -> (shard_ids, Popen)
+
+    def start(cluster_id, shard_ids):
+        env = dict(os.environ, SHARD_IDS=",".join(map(str, shard_ids)), CLUSTER_ID=str(cluster_id))
+        clusters[cluster_id] = (shard_ids, subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env))
+        print(f"🧩 Cluster {cluster_id} started with shards {shard_ids}")
+        # Let this cluster identify all of its shards before the next one starts.
+        time.sleep(IDENTIFY_INTERVAL * len(shard_ids))
+
+    try:
+        for cluster_id in range(CLUSTER_COUNT):
+            shard_ids = list(range(cluster_id * per_cluster, min(SHARD_COUNT, (cluster_id + 1) * per_cluster)))
+            if shard_ids:
+                start(cluster_id, shard_ids)
+        while clusters:
+            time.sleep(5)
+            for cluster_id, (shard_ids, process) in list(clusters.items()):
+                code = process.poll()
+                if code is None:
+                    continue
+                if code == 0:
+                    del clusters[cluster_id]
+                else:
+                    print(f"⚠️ Cluster {cluster_id} exited with {code}, restarting")
+                    start(cluster_id, shard_ids)
+    finally:
+        for _, process in clusters.values():
+            process.terminate()
+        for _, process in clusters.values():
+            process.wait()
+
+
+if __name__ == "__main__":
+    if SHARD_COUNT and CLUSTER_COUNT > 1 and SHARD_IDS is None:
+        launch_clusters()
+    else:
+        asyncio.run(main())
@@ -0,0 +1,99 @@
+"""
+Train the auto-response relevance classifier from labeled fixtures.
+
+    python tools/train_relevance.py
+    python tools/train_relevance.py --train fixtures/relevance/train.jsonl --out models/relevance.npz
+
+Fixtures are JSON lines of {"text": ..., "label": 0 or 1}; 1 means the message deserves an
+unprompted reply. Fits logistic regression with Adam on the same hashed n-gram features the
+bot scores with, then reports accuracy on the eval fixtures next to the old keyword trigger.
+"""
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import jarvis  # noqa: E402
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+
+
+def load_fixtures(path):
+    with open(path, encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    return [row["text"] for row in rows], np.array([row["label"] for row in rows], dtype=np.float64)
+
+
+def train(texts, labels, bits, epochs, lr, l2):
+    features, owners = jarvis.hash_ngrams(texts, bits)
+    scale = 1 / np.sqrt(np.maximum(np.bincount(owners, minlength=len(texts)), 1))
+    per_ngram = scale[owners]
+    weights = np.zeros(1 << bits)
+    bias = 0.0
+    m, v = np.zeros_like(weights), np.zeros_like(weights)
+    mb = vb = 0.0
+    beta1, beta2, eps = 0.9, 0.999, 1e-8
+    for step in range(1, epochs + 1):
+        logits = bias + np.bincount(owners, weights=weights[features], minlength=len(texts)) * scale
+        error = (1 / (1 + np.exp(-logits)) - labels) / len(texts)
+        grad = np.bincount(features, weights=error[owners] * per_ngram, minlength=len(weights)) + l2 * weights
+        grad_bias = error.sum()
+        m = beta1 * m + (1 - beta1) * grad
+        v = beta2 * v + (1 - beta2) * grad * grad
+        mb = beta1 * mb + (1 - beta1) * grad_bias
+        vb = beta2 * vb + (1 - beta2) * grad_bias * grad_bias
+        correction = np.sqrt(1 - beta2 ** step) / (1 - beta1 ** step)
+        weights -= lr * correction * m / (np.sqrt(v) + eps)
+        bias -= lr * correction * mb / (np.sqrt(vb) + eps)
+    return jarvis.RelevanceModel(weights.astype(np.float32), bias, bits)
+
+
+def report(name, predicted, labels):
+    predicted = np.asarray(predicted, dtype=bool)
+    actual = labels.astype(bool)
+    tp = int((predicted & actual).sum())
+    fp = int((predicted & ~actual).sum())
+    fn = int((~predicted & actual).sum())
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    accuracy = float((predicted == actual).mean())
+    print(f"{name:<10} accuracy {accuracy:.3f}  precision {precision:.3f}  recall {recall:.3f}  f1 {f1:.3f}  "
+          f"false triggers {fp}/{int((~actual).sum())}")
+
+
+def evaluate(model, texts, labels, threshold):
+    report("model", model.scores(texts) >= threshold, labels)
+    report("keywords", [jarvis.KEYWORD_RE.search(text.lower()) is not None for text in texts], labels)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--train", default=os.path.join(ROOT, "fixtures", "relevance", "train.jsonl"))
+    parser.add_argument("--eval", default=os.path.join(ROOT, "fixtures", "relevance", "eval.jsonl"))
+    parser.add_argument("--out", default=os.path.join(ROOT, "models", "relevance.npz"))
+    parser.add_argument("--bits", type=int, default=jarvis.FEATURE_BITS)
+    parser.add_argument("--epochs", type=int, default=300)
+    parser.add_argument("--lr", type=float, default=0.05)
+    parser.add_argument("--l2", type=float, default=1e-4)
+    parser.add_argument("--threshold", type=float, default=jarvis.RELEVANCE_THRESHOLD)
+    args = parser.parse_args()
+
+    texts, labels = load_fixtures(args.train)
+    model = train(texts, labels, args.bits, args.epochs, args.lr, args.l2)
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    model.save(args.out)
+    print(f"Trained on {len(texts)} messages -> {args.out} ({os.path.getsize(args.out) / 1024:.0f} KiB)")
+
+    print("train:")
+    evaluate(model, texts, labels, args.threshold)
+    eval_texts, eval_labels = load_fixtures(args.eval)
+    print(f"eval ({len(eval_texts)} messages):")
+    evaluate(model, eval_texts, eval_labels, args.threshold)
+
+
+if __name__ == "__main__":
+    main()